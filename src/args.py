@@ -1,4 +1,15 @@
 import argparse
+import os
+import tempfile
+
+
+def positive_int(value):
+    """argparse type for counts of workers and slots, which must be at least 1"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {value}")
+    return number
+
 
 def parse():
     arg_parser = argparse.ArgumentParser(
@@ -39,9 +50,36 @@ def parse():
         const=True,
     )
 
+    arg_parser.add_argument(
+        "--linkmode",
+        help="how to copy bare files: 'reflink' shares unchanged data blocks with the game install where the filesystem supports it",
+        choices=["copy", "reflink"],
+        default="copy",
+    )
+
+    arg_parser.add_argument(
+        "--outputmode",
+        help="write each game to a folder, or stream its files into a single uncompressed tar or zip file in the output path",
+        choices=["dir", "tar", "zip"],
+        default="dir",
+    )
+
+    arg_parser.add_argument(
+        "--scratchpath",
+        help="local folder where games are extracted before they are written to their tar or zip file",
+        default=tempfile.gettempdir(),
+    )
+
+    arg_parser.add_argument(
+        "--dedup",
+        help="find tracks whose audio is already in the output path from another game or source: 'link' hard links them to the first copy, which keeps its tags, 'skip' leaves them out",
+        choices=["off", "link", "skip"],
+        default="off",
+    )
+
     arg_parser.add_argument(
         "--rescan",
-        help="extract music for target directories that already exist",
+        help="extract music for target directories that already exist, skipping sources unchanged since the last run",
         default=False,
         action="store_const",
         const=True,
@@ -59,6 +97,121 @@ def parse():
         help="convert wav files to alternate format [mp3, ogg, flac]"
     )
 
+    arg_parser.add_argument(
+        "--convertjobs",
+        help="maximum number of wav files to convert at once",
+        type=positive_int,
+        default=os.cpu_count() or 1,
+    )
+
+    arg_parser.add_argument(
+        "--convertmemory",
+        help="memory in MB that simultaneous wav conversions may use",
+        type=int,
+        default=1024,
+    )
+
+    arg_parser.add_argument(
+        "--assetsmemory",
+        help="memory in MB that Unity audio clips being decoded at once may use",
+        type=int,
+        default=1024,
+    )
+
+    arg_parser.add_argument(
+        "-j",
+        "--jobs",
+        help="number of games to extract in parallel worker processes",
+        type=positive_int,
+        default=1,
+    )
+
+    arg_parser.add_argument(
+        "--threads",
+        help="number of files to probe, copy and tag concurrently within a step",
+        type=positive_int,
+        default=4,
+    )
+
+    arg_parser.add_argument(
+        "--tooljobs",
+        help="maximum number of simultaneous runs of each external tool, across all games",
+        type=positive_int,
+        default=2,
+    )
+
+    arg_parser.add_argument(
+        "--hddjobs",
+        help="maximum number of files copied or extracted at once from or to each spinning disk, across all games",
+        type=positive_int,
+        default=1,
+    )
+
+    arg_parser.add_argument(
+        "--ssdjobs",
+        help="maximum number of files copied or extracted at once from or to each other drive, across all games",
+        type=positive_int,
+        default=16,
+    )
+
+    arg_parser.add_argument(
+        "--tooltimeout",
+        help="seconds after which a run of an external tool is stopped",
+        type=int,
+        default=1800,
+    )
+
+    arg_parser.add_argument(
+        "--dryrun",
+        help="print what would be extracted from each game as json, without writing anything",
+        default=False,
+        action="store_const",
+        const=True,
+    )
+
+    arg_parser.add_argument(
+        "--watch",
+        help="keep running, extracting games whenever Steam installs or updates them",
+        default=False,
+        action="store_const",
+        const=True,
+    )
+
+    arg_parser.add_argument(
+        "--watchdebounce",
+        help="seconds an appmanifest must go unchanged before its game is extracted with --watch",
+        type=int,
+        default=60,
+    )
+
+    arg_parser.add_argument(
+        "--watchinterval",
+        help="seconds between checks of the Steam libraries with --watch, where inotify is unavailable",
+        type=int,
+        default=30,
+    )
+
+    arg_parser.add_argument(
+        "--watchstatus",
+        help="json file showing the games pending and being extracted with --watch, by default .vgmx-watch.json in the output path",
+    )
+
+    arg_parser.add_argument(
+        "--statsjson",
+        help="write timing and counters of every game and step to this json file",
+    )
+
+    arg_parser.add_argument(
+        "--profilegame",
+        help="profile the extraction of this game with cProfile",
+    )
+
+    arg_parser.add_argument(
+        "--profileoutput",
+        help="file to write the --profilegame profile to, for pstats or snakeviz",
+        default="vgm-extractor.prof",
+    )
+
     args = arg_parser.parse_args()
     args.parser = arg_parser
     return args
\ No newline at end of file
@@ -2,17 +2,80 @@ import argparse
 from pathlib import Path
 import vdf
 
+import dedup
+import probe_cache
+
 from sys import platform
 if platform.startswith("win"):
     import winreg
 
 
+# appmanifest StateFlags: installed, and not being updated, moved or validated by Steam.
+# An update that is required but not started (0x2) leaves the installed files as they were.
+STATE_FULLY_INSTALLED = 4
+STATE_BUSY = (
+    0x100 | 0x200 | 0x400  # update running, paused, started
+    | 0x800 | 0x1000  # uninstalling, backup running
+    | 0x10000 | 0x20000  # reconfiguring, validating
+    | 0x40000 | 0x80000 | 0x100000  # adding files, preallocating, downloading
+    | 0x200000 | 0x400000 | 0x800000  # staging, committing, update stopping
+)
+
+
+class InstalledApp:
+    """A Steam app as described by the appmanifest_<appid>.acf file in its library"""
+    def __init__(self, library_path, app_state):
+        self.library_path = library_path
+        self.appid = app_state.get("appid")
+        self.name = app_state.get("name")
+        self.installdir = app_state["installdir"]
+        self.buildid = app_state.get("buildid")
+        self.state_flags = int(app_state.get("StateFlags", 0))
+
+    @property
+    def game_folder(self):
+        return self.library_path / "steamapps/common" / self.installdir
+
+    @property
+    def is_ready(self):
+        """Whether Steam has finished installing or updating the app"""
+        return bool(self.state_flags & STATE_FULLY_INSTALLED) and not self.state_flags & STATE_BUSY
+
+
+def read_appmanifest(library_path, appmanifest_path):
+    with open(appmanifest_path, encoding="utf-8") as acf_file:
+        appmanifest = vdf.parse(acf_file)
+    # the single top level key is "AppState"
+    return InstalledApp(library_path, next(iter(appmanifest.values())))
+
+
+def read_library_apps(library_path):
+    """Installed apps of a library keyed by install dir, or None if it has no appmanifests"""
+    apps = None
+    for appmanifest_path in sorted((library_path / "steamapps").glob("appmanifest_*.acf")):
+        if apps is None:
+            apps = {}
+        try:
+            app = read_appmanifest(library_path, appmanifest_path)
+        except (OSError, SyntaxError, KeyError, StopIteration, ValueError):
+            # skip manifests that are unreadable or half written by Steam
+            continue
+        apps[app.installdir] = app
+    return apps
+
+
 class Config:
     def __init__(self, args, gamedata):
         if not Path(args.outputpath).is_dir():
             args.parser.error("outputpath is not a directory")
 
         self.output_path = Path(args.outputpath)
+        self.probe_cache = probe_cache.ProbeCache(self.output_path / probe_cache.CACHE_NAME)
+        self.content_store = None
+        if args.dedup != "off" and args.outputmode != "dir":
+            args.parser.error("--dedup needs the tracks it links or skips to stay in the output path, use --outputmode dir")
+        if args.dedup != "off":
+            self.content_store = dedup.ContentStore(self.output_path, args.dedup)
 
         if args.steamlibrarypath:
             path = Path(args.steamlibrarypath)
@@ -59,10 +122,48 @@ class Config:
                 "Failed to locate any Steam library directory, use --steamlibrarypath argument instead"
             )
 
+        self.read_apps()
+
         self.gamedata = gamedata
 
         self.games = args.games
         if len(self.games) == 0:
             self.games = sorted(gamedata.keys())
 
+    def read_apps(self):
+        """Read the installed apps of each library, once so finding a game needs no disk access, or again after Steam changed them"""
+        self.library_apps = {path: read_library_apps(path) for path in self.steam_library_paths}
 
+    def games_installed_in(self, installdir):
+        """The configured games with installdir as one of their game folders"""
+        games = []
+        for game_name in self.games:
+            if game_name not in self.gamedata:
+                continue
+            game_folders = self.gamedata[game_name]["game_folder"]
+            if not isinstance(game_folders, list):
+                game_folders = [game_folders]
+            if installdir in game_folders:
+                games.append(game_name)
+        return games
+
+    def find_game_folder(self, game_folders):
+        """The first installed game folder of any name in game_folders, and its InstalledApp
+
+        Apps Steam is still installing or updating count as not installed.
+        Libraries without any appmanifests, such as a plain folder of games
+        given with --steamlibrarypath, are searched by checking for the folder.
+        """
+        for steam_library_path in self.steam_library_paths:
+            apps = self.library_apps[steam_library_path]
+            for game_folder in game_folders:
+                if apps is None:
+                    path = steam_library_path / "steamapps/common" / game_folder
+                    if path.is_dir():
+                        return path, None
+                elif game_folder in apps:
+                    app = apps[game_folder]
+                    # moved away by hand, or being downloaded or updated by Steam
+                    if app.is_ready and app.game_folder.is_dir():
+                        return app.game_folder, app
+        return None, None
@@ -0,0 +1,90 @@
+import os
+import shutil
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import file_util
+import stats
+import steps
+
+# resident memory of one streaming ffmpeg encode, which --convertmemory is divided by
+FFMPEG_MEMORY_MB = 64
+
+
+class WavConverter():
+    """Converts wav files in the background with ffmpeg as soon as they are submitted
+
+    ffmpeg streams each file from disk, so memory use does not grow with the
+    size of the wav. The number of simultaneous ffmpeg processes is limited by
+    --convertjobs and by how many fit in --convertmemory.
+    """
+    def __init__(self, args, gameconfig):
+        self.args = args
+        self.format = args.convertwav
+        self.verbose = args.verbose
+        self.gameconfig = gameconfig
+        self.ffmpeg = shutil.which("ffmpeg") or shutil.which("avconv")
+        jobs = max(1, min(args.convertjobs, args.convertmemory // FFMPEG_MEMORY_MB))
+        self.executor = ThreadPoolExecutor(max_workers=jobs)
+        self.futures = []
+        self.submitted = set()
+        # conversions overlap later steps, so they are counted as a step of their own
+        self.stats = stats.StepStats("convertwav")
+
+    def submit_new(self):
+        """Start converting wav files written so far which have not been submitted yet"""
+        for path in self.gameconfig.outputs.glob("**/*.wav"):
+            if path not in self.submitted:
+                if self.ffmpeg is None:
+                    raise FileNotFoundError("ffmpeg or avconv is required for --convertwav")
+                self.submitted.add(path)
+                self.futures.append(self.executor.submit(self.convert, path))
+
+    def convert(self, path):
+        dst = path.with_suffix("." + self.format)
+        temp_file, temp_path = file_util.stage(dst)
+        temp_file.close()
+        size = path.stat().st_size
+        start = time.perf_counter()
+        try:
+            try:
+                steps.run_tool(
+                    self.args,
+                    self.gameconfig,
+                    [
+                        self.ffmpeg, "-nostdin", "-hide_banner", "-loglevel", "error", "-y",
+                        "-i", path, "-f", self.format, temp_path,
+                    ],
+                    step_stats=self.stats,
+                )
+            except steps.ToolError as error:
+                raise steps.ToolError("failed to convert " + str(path) + ": " + str(error)) from None
+            os.replace(temp_path, dst)
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+        path.unlink()
+        self.gameconfig.manifest.rename_output(path, dst)
+        self.gameconfig.outputs.rename(path, dst)
+        seconds = time.perf_counter() - start
+        self.stats.count("bytes_read", size)
+        self.stats.count("bytes_written", dst.stat().st_size)
+        return path, dst, size, seconds
+
+    def finish(self):
+        """Wait for all conversions, printing their throughput, and raise the first failure"""
+        start = time.perf_counter()
+        try:
+            for future in self.futures:
+                path, dst, size, seconds = future.result()
+                if self.verbose > 1:
+                    megabytes = size / 1024 / 1024
+                    print(
+                        f"  {path.name} -> {dst.name}: {megabytes:.1f} MB in {seconds:.1f} s"
+                        f" ({megabytes / max(seconds, 0.001):.1f} MB/s)"
+                    )
+        finally:
+            self.executor.shutdown(cancel_futures=True)
+            # only the time spent waiting for conversions after the last step
+            self.stats.wall_time += time.perf_counter() - start
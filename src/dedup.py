@@ -0,0 +1,172 @@
+import hashlib
+import mmap
+import os
+import struct
+
+from pathlib import Path
+
+import stats
+import thread_sqlite
+
+STORE_NAME = ".vgmx-content.sqlite"
+# RIFF chunks holding tags rather than audio
+RIFF_TAG_CHUNKS = [b"LIST", b"id3 ", b"ID3 ", b"bext", b"iXML"]
+FLAC_STREAMINFO = 0
+
+
+def id3v2_end(data, start):
+    """Offset just past any ID3v2 tags at start"""
+    while data[start:start + 3] == b"ID3" and len(data) >= start + 10:
+        flags = data[start + 5]
+        size = 0
+        for byte in data[start + 6:start + 10]:
+            size = size << 7 | byte & 0x7F
+        start += 10 + size + (10 if flags & 0x10 else 0)
+    return start
+
+
+def trailing_tags_start(data, end):
+    """Offset of any ID3v1 and APEv2 tags ending at end"""
+    while True:
+        if end >= 128 and data[end - 128:end - 125] == b"TAG":
+            end -= 128
+        elif end >= 32 and data[end - 32:end - 24] == b"APETAGEX":
+            size, _, flags = struct.unpack_from("<III", data, end - 20)
+            end -= size + (32 if flags & 0x80000000 else 0)
+        else:
+            return end
+
+
+def hash_ogg(data, digest):
+    """Hash the identification page, then the granule position and body of every audio page"""
+    position = 0
+    while data[position:position + 4] == b"OggS" and position + 27 <= len(data):
+        header_type = data[position + 5]
+        granule, = struct.unpack_from("<q", data, position + 6)
+        segments = data[position + 26]
+        body_start = position + 27 + segments
+        body_end = body_start + sum(data[position + 27:body_start])
+        # comment and setup headers come on pages before any audio, at granule 0
+        if header_type & 0x02 or granule != 0:
+            digest.update(struct.pack("<q", granule))
+            digest.update(data[body_start:body_end])
+        position = body_end
+
+
+def hash_riff(data, digest):
+    """Hash every chunk but those holding tags"""
+    digest.update(data[8:12])
+    position = 12
+    while position + 8 <= len(data):
+        chunk_id = data[position:position + 4]
+        size, = struct.unpack_from("<I", data, position + 4)
+        if chunk_id not in RIFF_TAG_CHUNKS:
+            digest.update(data[position:position + 8 + size])
+        position += 8 + size + size % 2
+
+
+def hash_flac(data, start, end, digest):
+    """Hash STREAMINFO and the audio frames, but not comments, pictures or padding"""
+    position = start + 4
+    last = False
+    while not last and position + 4 <= end:
+        header = data[position]
+        last = header & 0x80
+        size = int.from_bytes(data[position + 1:position + 4], "big")
+        if header & 0x7F == FLAC_STREAMINFO:
+            digest.update(data[position + 4:position + 4 + size])
+        position += 4 + size
+    digest.update(data[position:end])
+
+
+def payload_hash(data):
+    """sha256 hex digest of the audio in a file's contents, leaving out its tags
+
+    Files differing only in their tags, such as the album set for each game, have
+    the same hash. Formats without known tags are hashed whole.
+    """
+    digest = hashlib.sha256()
+    with memoryview(data) as view:
+        if view[:4] == b"OggS":
+            hash_ogg(view, digest)
+        elif view[:4] == b"RIFF":
+            hash_riff(view, digest)
+        else:
+            start = id3v2_end(view, 0)
+            end = trailing_tags_start(view, len(view))
+            if view[start:start + 4] == b"fLaC":
+                hash_flac(view, start, end, digest)
+            else:
+                digest.update(view[start:end])
+    return digest.hexdigest()
+
+
+def file_payload_hash(path):
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return payload_hash(b"")
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return payload_hash(data)
+
+
+class Duplicate(Exception):
+    """A file left out, as holder already has the same audio"""
+    def __init__(self, holder):
+        super().__init__(holder)
+        self.holder = holder
+
+
+class ContentStore():
+    """Outputs in an output path keyed by the hash of their audio, to find duplicates across games
+
+    mode "link" hard links a duplicate to the output that has the same audio,
+    which keeps that output's tags, and "skip" leaves the duplicate out. Like
+    ProbeCache, each thread gets its own sqlite connection.
+    """
+    def __init__(self, output_path, mode):
+        self.output_path = Path(output_path)
+        self.path = self.output_path / STORE_NAME
+        self.mode = mode
+        self.connections = thread_sqlite.ThreadConnections(
+            self.path, "CREATE TABLE IF NOT EXISTS outputs (hash TEXT PRIMARY KEY, path TEXT)"
+        )
+
+    def claim(self, digest, dst):
+        """The output already holding the audio with this hash, or None after recording dst as its holder"""
+        relative = Path(dst).relative_to(self.output_path).as_posix()
+        connection = self.connections.get()
+        connection.execute("INSERT OR IGNORE INTO outputs VALUES (?, ?)", (digest, relative))
+        path, = connection.execute("SELECT path FROM outputs WHERE hash = ?", (digest,)).fetchone()
+        if path == relative:
+            return None
+        existing = self.output_path / path
+        if not existing.is_file():
+            # deleted, filtered or renamed since, so dst holds the audio from now on
+            connection.execute("UPDATE outputs SET path = ? WHERE hash = ?", (relative, digest))
+            return None
+        return existing
+
+    def place(self, digest, dst, overwrite = False):
+        """Link dst to an output with the same audio, or leave it out, returning that output or None"""
+        existing = self.claim(digest, dst)
+        if existing is None:
+            return None
+        size = os.stat(existing).st_size
+        if self.mode == "link":
+            if os.path.lexists(dst) and os.path.samefile(existing, dst):
+                # linked on an earlier run, and renaming a link over the same file does nothing
+                pass
+            elif not overwrite and os.path.lexists(dst):
+                raise FileExistsError
+            else:
+                temp_path = Path(dst).with_name("." + Path(dst).name + ".vgmx-link")
+                temp_path.unlink(missing_ok=True)
+                try:
+                    os.link(existing, temp_path)
+                except OSError:
+                    # the filesystem has no hard links, so dst is written after all
+                    return None
+                os.replace(temp_path, dst)
+        stats.count("files_deduplicated")
+        stats.count("bytes_deduplicated", size)
+        return existing
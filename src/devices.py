@@ -0,0 +1,79 @@
+import contextlib
+import multiprocessing
+import os
+
+from pathlib import Path
+
+from sys import platform
+
+
+def device_of(path):
+    """st_dev of the filesystem holding path, or None if it is not there"""
+    try:
+        return os.stat(path).st_dev
+    except OSError:
+        return None
+
+
+def is_rotational(device):
+    """Whether a device is a spinning disk, False where the OS does not tell, such as on a network share"""
+    if not platform.startswith("linux"):
+        return False
+    block = Path("/sys/dev/block") / f"{os.major(device)}:{os.minor(device)}"
+    try:
+        block = block.resolve(strict=True)
+    except OSError:
+        # btrfs, tmpfs and network filesystems have no block device of their own
+        return False
+    # a partition has no queue, the disk holding it does
+    for queue in [block / "queue", block.parent / "queue"]:
+        try:
+            return (queue / "rotational").read_text().strip() == "1"
+        except OSError:
+            continue
+    return False
+
+
+class DeviceSlots():
+    """Limits on simultaneous reads and writes on each drive, shared by every game being extracted
+
+    Each drive holding a library or the output path gets --hddjobs slots if it
+    is a spinning disk and --ssdjobs otherwise, so a hard disk is not made to
+    seek between many files at once while other drives take more. Like
+    steps.tool_slots the semaphores come from multiprocessing, for worker
+    processes extracting different games to share them. Drives not found at
+    startup are not limited.
+    """
+    def __init__(self, paths = (), hddjobs = 1, ssdjobs = 16):
+        self.slots = {}
+        self.rotational = {}
+        self.jobs = {}
+        for path in paths:
+            device = device_of(path)
+            if device is None or device in self.slots:
+                continue
+            self.rotational[device] = is_rotational(device)
+            self.jobs[device] = hddjobs if self.rotational[device] else ssdjobs
+            self.slots[device] = multiprocessing.BoundedSemaphore(self.jobs[device])
+
+    def is_rotational(self, device):
+        return self.rotational.get(device, False)
+
+    def jobs_on(self, device, default):
+        """The number of slots of device, or default if it is not limited"""
+        return self.jobs.get(device, default)
+
+    @contextlib.contextmanager
+    def using(self, *devices):
+        """Hold a slot on each of devices, taken in device order so holders of several can't deadlock"""
+        with contextlib.ExitStack() as stack:
+            for device in sorted(set(devices) & self.slots.keys()):
+                stack.enter_context(self.slots[device])
+            yield
+
+
+def make_device_slots(configuration, args):
+    paths = [library_path / "steamapps/common" for library_path in configuration.steam_library_paths]
+    paths += configuration.steam_library_paths
+    paths.append(args.scratchpath if args.outputmode != "dir" else args.outputpath)
+    return DeviceSlots(paths, args.hddjobs, args.ssdjobs)
@@ -0,0 +1,385 @@
+import argparse
+import concurrent.futures
+import contextlib
+import cProfile
+import io
+import itertools
+import shutil
+import signal
+import time
+import traceback
+
+from pathlib import Path
+
+import config
+import convert
+import devices
+import gamedata
+import game_config
+import output_sink
+import stats
+import steps
+
+
+class GameResult():
+    """Outcome of extracting one game, returned from worker processes"""
+    def __init__(self, game_name):
+        self.game_name = game_name
+        self.extracted = False
+        self.output = ""
+        self.error = None
+        # wall time and the stats of each step, as plain data
+        self.stats = None
+
+
+class GamePlan():
+    """The planned actions of every step of a game, empty if it needs no extraction"""
+    def __init__(self, game_name, game_configuration=None, step_instances=None):
+        self.game_name = game_name
+        self.game_configuration = game_configuration
+        self.step_instances = step_instances or []
+        self.actions = []
+        self.error = None
+
+    def pending(self):
+        """Actions expected to write something: runs, and the first copy or extract of each destination"""
+        destinations = set()
+        for action in self.actions:
+            if action.action == "run":
+                yield action
+            elif action.action in steps.WRITING_ACTIONS and action.destination not in destinations:
+                destinations.add(action.destination)
+                yield action
+
+    @property
+    def size(self):
+        return sum(action.size for action in self.pending())
+
+    def to_dict(self):
+        game_configuration = self.game_configuration
+        actions = []
+        destinations = set()
+        for action in self.actions:
+            action_dict = action.to_dict(game_configuration)
+            if action.action in steps.WRITING_ACTIONS:
+                # only written if every earlier source for it turns out too short
+                action_dict["duplicate"] = action.destination in destinations
+                destinations.add(action.destination)
+            actions.append(action_dict)
+        return {
+            "game": self.game_name,
+            "game_folder": str(game_configuration.game_folder) if game_configuration else None,
+            "output": str(game_configuration.output_game_path) if game_configuration else None,
+            "files": sum(1 for action in self.pending() if action.action in steps.WRITING_ACTIONS),
+            "bytes": self.size,
+            "error": self.error.splitlines()[-1] if self.error else None,
+            "actions": actions,
+        }
+
+
+def prepare_game(configuration, args, game_name, game_index = None):
+    """GameConfig and step instances of a game, or None if it is not installed or needs no extraction
+
+    game_index is a folder_index.FolderIndex of the game folder already read, if any.
+    """
+    if game_name not in configuration.gamedata:
+        raise FileNotFoundError("no game data for " + game_name)
+    game_configuration = game_config.GameConfig(
+        configuration, args, game_name, configuration.gamedata[game_name], game_index
+    )
+    if not game_configuration.game_folder:
+        return None
+    if game_configuration.output_exists() and not args.rescan:
+        return None
+    extract_steps = configuration.gamedata[game_name]["extract_steps"]
+    if not args.overwrite and game_configuration.manifest.is_build_current(
+        game_configuration.buildid, extract_steps
+    ):
+        # Steam has not updated the game since it was last extracted
+        return None
+    step_instances = []
+    for index, step in enumerate(extract_steps):
+        # The type of extraction step is identified by one or more unique keys
+        for k,func in steps.StepFuncs.items():
+            if k in step:
+                step_instances.append(func(step, index))
+    return game_configuration, step_instances
+
+
+def plan_game(configuration, args, game_name, estimate = False):
+    """What extracting a game would do, without writing anything, reporting failures in the plan
+
+    With estimate, archives are not listed, see steps.Step.plan.
+    """
+    game_plan = GamePlan(game_name)
+    try:
+        prepared = prepare_game(configuration, args, game_name)
+        if prepared is None:
+            return game_plan
+        game_plan.game_configuration, game_plan.step_instances = prepared
+        for step_instance in game_plan.step_instances:
+            game_plan.actions.extend(step_instance.plan(configuration, args, game_plan.game_configuration, estimate))
+    except Exception:
+        game_plan.error = traceback.format_exc()
+    return game_plan
+
+
+def plan_report(game_plans):
+    """The --dryrun output, listing the plan of every game that needs extraction"""
+    games = [game_plan.to_dict() for game_plan in game_plans if game_plan.actions or game_plan.error]
+    return {
+        "games": games,
+        "files": sum(game["files"] for game in games),
+        "bytes": sum(game["bytes"] for game in games),
+    }
+
+
+def extract_game(configuration, args, game_name, game_plan = None, game_index = None):
+    """Run every extract step for one game, reporting failures in the result instead of raising
+
+    The game configuration and steps of game_plan are reused if it has them,
+    otherwise the game folder listings in game_index are.
+    """
+    result = GameResult(game_name)
+    step_records = []
+    profiler = None
+    if args.profilegame == game_name:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start = time.perf_counter()
+    game_configuration = None
+    try:
+        if game_plan is not None and game_plan.game_configuration is not None:
+            prepared = game_plan.game_configuration, game_plan.step_instances
+        else:
+            prepared = prepare_game(configuration, args, game_name, game_index)
+        if prepared is None:
+            return result
+        game_configuration, step_instances = prepared
+        extract_steps = configuration.gamedata[game_name]["extract_steps"]
+        scratch = game_configuration.output_archive_path is not None
+        if scratch:
+            # left behind by a run that was killed
+            shutil.rmtree(game_configuration.output_game_path, ignore_errors=True)
+        Path(game_configuration.output_game_path).mkdir(parents=scratch, exist_ok=True)
+        if args.verbose > 0:
+            print(game_name)
+        result.extracted = True
+        sink = output_sink.make_sink(args, game_configuration)
+        converter = None
+        hold = None
+        if args.convertwav:
+            converter = convert.WavConverter(args, game_configuration)
+            # wav files stay until their conversion replaces them
+            hold = lambda path: path.suffix == ".wav"
+        # wav files are converted, and outputs moved to an archive, as soon as no
+        # later step can still rename or filter them
+        last_postprocess = max(
+            (position for position, step_instance in enumerate(step_instances) if step_instance.postprocess),
+            default=-1,
+        )
+        try:
+            try:
+                for position, step_instance in enumerate(step_instances):
+                    step_records.append(stats.StepStats(step_instance.key, step_instance.index))
+                    with stats.recording(step_records[-1]):
+                        step_instance.run(configuration, args, game_configuration)
+                    if position >= last_postprocess:
+                        if converter:
+                            converter.submit_new()
+                        sink.drain(game_configuration.outputs, hold)
+            finally:
+                if converter:
+                    converter.finish()
+                    step_records.append(converter.stats)
+
+            sink.drain(game_configuration.outputs)
+            game_configuration.manifest.set_build(game_configuration.buildid, extract_steps)
+            game_configuration.manifest.save(sink.names)
+            if not game_configuration.manifest.has_outputs():
+                # leave nothing behind, so the game is tried again on the next run
+                game_configuration.manifest.remove()
+            sink.close()
+        except BaseException:
+            sink.abort()
+            raise
+        finally:
+            if scratch:
+                shutil.rmtree(game_configuration.output_game_path, ignore_errors=True)
+                with contextlib.suppress(OSError):
+                    # the scratch folder of this process, unless another game is in it
+                    game_configuration.output_game_path.parent.rmdir()
+
+        # TODO keep track of games that are found but produce no audio files
+        game_configuration.outputs.remove_empty_dirs()
+    except Exception:
+        result.error = traceback.format_exc()
+        if game_configuration is not None:
+            # an output folder left empty would keep the game from being tried again without --rescan
+            game_configuration.outputs.remove_empty_dirs()
+    finally:
+        result.stats = {
+            "wall_time": time.perf_counter() - start,
+            "steps": [record.to_dict() for record in step_records],
+        }
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profileoutput)
+    return result
+
+
+# Each worker process builds its own configuration, because game data holds
+# loaded python modules and the parsed arguments hold the parser, neither of
+# which can be sent between processes
+worker_configuration = None
+worker_args = None
+
+
+def init_worker(args, tool_slots, device_slots):
+    global worker_configuration, worker_args
+    # Ctrl-C reaches every process, the parent alone shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker_args = args
+    steps.tool_slots = tool_slots
+    steps.device_slots = device_slots
+    worker_configuration = config.Config(args, gamedata.load())
+
+
+def extract_game_in_worker(game_name, read_apps = False, game_index = None):
+    """extract_game() with its printed output captured, reading the Steam libraries again first if read_apps is set"""
+    if read_apps:
+        worker_configuration.read_apps()
+    buffer = io.StringIO()
+    with contextlib.redirect_stdout(buffer):
+        result = extract_game(worker_configuration, worker_args, game_name, game_index=game_index)
+    result.output = buffer.getvalue()
+    return result
+
+
+class Progress():
+    """Planned games and bytes extracted so far, and an estimate of the time left"""
+    def __init__(self, game_plans):
+        self.games = sum(1 for game_plan in game_plans if game_plan.actions)
+        self.size = sum(game_plan.size for game_plan in game_plans)
+        self.games_done = 0
+        self.size_done = 0
+        self.start = time.perf_counter()
+
+    def advance(self, game_plan):
+        if game_plan.actions:
+            self.games_done += 1
+            self.size_done += game_plan.size
+
+    def __str__(self):
+        message = (
+            f"[{self.games_done}/{self.games} games,"
+            f" {self.size_done / 1024 / 1024:.1f} of {self.size / 1024 / 1024:.1f} MB"
+        )
+        if self.size_done:
+            elapsed = time.perf_counter() - self.start
+            remaining = int(elapsed * (self.size - self.size_done) / self.size_done)
+            message += f", {remaining // 60}:{remaining % 60:02} left"
+        return message + "]"
+
+
+def plan_games(configuration, args, estimate = False):
+    return [plan_game(configuration, args, game_name, estimate) for game_name in configuration.games]
+
+
+def interleave_by_device(game_plans):
+    """Game plans largest first, taking turns between the drives the games are on
+
+    Worker processes then read from every library drive at once, instead of
+    all waiting on the slots of one hard disk while another drive is idle.
+    """
+    by_device = {}
+    for game_plan in sorted(game_plans, key=lambda game_plan: game_plan.size, reverse=True):
+        game_configuration = game_plan.game_configuration
+        device = devices.device_of(game_configuration.game_folder) if game_configuration else None
+        by_device.setdefault(device, []).append(game_plan)
+    return [
+        game_plan
+        for game_plans_in_turn in itertools.zip_longest(*by_device.values())
+        for game_plan in game_plans_in_turn
+        if game_plan is not None
+    ]
+
+
+def extract_games(configuration, args):
+    """Extract all configured games, yielding their results
+
+    Games are planned first for progress reports at -v, and with several jobs so
+    the largest on each drive start first and small ones fill in around them.
+    Results then come in the order games finish, otherwise in the order of
+    configuration.games.
+    """
+    steps.device_slots = devices.make_device_slots(configuration, args)
+    if args.jobs <= 1 and args.verbose == 0:
+        for game_name in configuration.games:
+            yield extract_game(configuration, args, game_name)
+        return
+    # sizes from the folder indexes are enough to order games and report progress,
+    # archives are listed by the step extracting them
+    game_plans = plan_games(configuration, args, estimate=True)
+    progress = Progress(game_plans)
+    if args.jobs <= 1:
+        for game_plan in game_plans:
+            result = extract_game(configuration, args, game_plan.game_name, game_plan)
+            progress.advance(game_plan)
+            if game_plan.actions:
+                print(progress)
+            yield result
+        return
+    worker_args = argparse.Namespace(**vars(args))
+    del worker_args.parser
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=args.jobs,
+        initializer=init_worker,
+        initargs=(worker_args, steps.make_tool_slots(args.tooljobs), steps.device_slots),
+    ) as executor:
+        futures = {}
+        try:
+            for game_plan in interleave_by_device(game_plans):
+                if not game_plan.actions and not game_plan.error:
+                    # not installed, or nothing changed since it was extracted
+                    yield GameResult(game_plan.game_name)
+                    continue
+                # the game folder was walked to plan the game, and the worker takes over the listings
+                game_index = game_plan.game_configuration.game_index if game_plan.game_configuration else None
+                futures[executor.submit(extract_game_in_worker, game_plan.game_name, False, game_index)] = game_plan
+            # each game's output is printed in one piece as it finishes
+            for future in concurrent.futures.as_completed(futures):
+                result = future.result()
+                print(result.output, end="")
+                progress.advance(futures[future])
+                if args.verbose > 0:
+                    print(progress)
+                yield result
+        except BaseException:
+            # interrupted, so only the games already running are finished
+            executor.shutdown(cancel_futures=True)
+            raise
+
+
+def print_summary(results, args):
+    failures = [result for result in results if result.error]
+    if args.verbose > 0:
+        extracted = sum(1 for result in results if result.extracted)
+        print(f"{extracted} of {len(results)} games extracted")
+    if args.dedup != "off":
+        totals = stats.add_up(
+            [step_dict for result in results if result.stats for step_dict in result.stats["steps"]]
+        )
+        if totals["files_deduplicated"]:
+            print(
+                f"{totals['files_deduplicated']} duplicate files {'linked' if args.dedup == 'link' else 'skipped'},"
+                f" {totals['bytes_deduplicated'] / 1024 / 1024:.1f} MB saved"
+            )
+    if failures:
+        print(f"{len(failures)} games failed:")
+        for result in failures:
+            if args.verbose > 0:
+                print(result.game_name)
+                print(result.error, end="")
+            else:
+                print("  " + result.game_name + ": " + result.error.splitlines()[-1])
@@ -2,66 +2,169 @@ import mutagen
 import os
 from pathlib import Path
 import shutil
+import tempfile
+
+import dedup
+import stats
+
+from sys import platform
+if not platform.startswith("win"):
+    import fcntl
+
+def set_album(mutafile, gamename, suffix = ""):
+    """Set the album tag of a file opened with mutagen unless it has one, returning whether it changed"""
+    albumtag = gamename
+    albumtag += suffix
+    # TODO handle ID3 Frame types for non-Easy classes
+    if "album" in mutafile:
+        return False
+    try:
+        mutafile["album"] = albumtag
+    except:
+        mutafile["album"] = mutagen.id3.TextFrame(encoding=3, text=[albumtag])
+    return True
+
 
 # apply id3/ogg/etc album tag to file
 def tag(file, gamename, suffix = ""):
     mutafile = mutagen.File(file, easy=True)
     if mutafile is not None:
-        albumtag = gamename
-        albumtag += suffix
-        # TODO handle ID3 Frame types for non-Easy classes
-        if "album" not in mutafile:
-            try:
-                mutafile["album"] = albumtag
-            except:
-                mutafile["album"] = mutagen.id3.TextFrame(encoding=3, text=[albumtag])
+        set_album(mutafile, gamename, suffix)
         mutafile.save()
 
 
-def file_func(func, src, dst, overwrite = False):
-    if Path(dst).is_dir():
-        dst = Path(dst).joinpath(Path(src).name)
-    else:
-        if not (Path(dst).parent.is_dir()):
-            os.makedirs(Path(dst).parent, exist_ok=True)
-    if not overwrite and dst.exists():
-        # do not overwrite existing files
-        raise FileExistsError
-    func(src, dst)
-    return dst
+def probe_and_tag(file, gamename, suffix = "", minduration = 0):
+    """Return the duration of file, tagging it if it lasts at least minduration, with a single mutagen open"""
+    stats.count("files_probed")
+    mutafile = mutagen.File(file, easy=True)
+    if mutafile is None:
+        return float("inf")  # unrecognized sound files and non sound files
+    if mutafile.info.length >= minduration and set_album(mutafile, gamename, suffix):
+        mutafile.save()
+    return mutafile.info.length
+
+
+# mkstemp creates files only the owner can read, staged files get the usual permissions instead
+UMASK = os.umask(0)
+os.umask(UMASK)
 
-def copy(src, dst, overwrite = False):
-    return file_func(shutil.copy, src, dst, overwrite)
 
-def move(src, dst, overwrite = False):
-    return file_func(shutil.move, src, dst, overwrite)
+def stage(dst):
+    """Open a temporary file beside dst, to be renamed over dst once it is complete
 
-def audio_duration(file):
+    The temporary name keeps the extension of dst, which mutagen uses to detect formats.
+    """
+    dst = Path(dst)
+    fd, temp = tempfile.mkstemp(prefix="." + dst.stem + ".", suffix=dst.suffix, dir=dst.parent)
+    os.chmod(temp, 0o666 & ~UMASK)
+    return os.fdopen(fd, "wb"), Path(temp)
+
+
+# Linux ioctl making a file share another file's data blocks, on btrfs, XFS and other copy on write filesystems
+FICLONE = 0x40049409
+
+
+def reflink_copy(src, dst):
+    """Copy src to dst sharing data blocks where possible
+
+    Falls back to copy_file_range, which filesystems and network mounts may
+    also handle without moving the data through this process, and then to
+    shutil, which uses sendfile where available.
+    """
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        except (OSError, NameError):
+            try:
+                size = os.fstat(src_file.fileno()).st_size
+                copied = 0
+                while copied < size:
+                    count = os.copy_file_range(src_file.fileno(), dst_file.fileno(), size - copied)
+                    if count == 0:
+                        break
+                    copied += count
+            except (OSError, AttributeError):
+                src_file.seek(0)
+                dst_file.seek(0)
+                dst_file.truncate()
+                shutil.copyfileobj(src_file, dst_file)
+    shutil.copymode(src, dst)
+
+
+def probe(file, cache = None):
+    """Duration of file and, unless it came from the cache, the file opened with mutagen"""
+    if cache is not None:
+        stat = os.stat(file)
+        probe = cache.get(Path(file).resolve(), stat)
+        if probe is not None:
+            return probe[0], None
+    stats.count("files_probed")
     mutafile = mutagen.File(file, easy=True)
     if mutafile is not None:
-        return mutafile.info.length
+        duration = mutafile.info.length
+        format = type(mutafile).__name__
     else:
-        return float("inf")  # unrecognized sound files and non sound files
+        duration = float("inf")  # unrecognized sound files and non sound files
+        format = None
+    if cache is not None:
+        cache.put(Path(file).resolve(), stat, duration, format)
+    return duration, mutafile
 
 
-def copy_and_tag(src, dst, gamename, overwrite = False):
-    dst = copy(src, dst, overwrite)
-    tag(dst, gamename)
+def audio_duration(file, cache = None):
+    return probe(file, cache)[0]
 
-def move_and_tag(src, dst, gamename, overwrite = False):
-    dst = move(src, dst, overwrite)
-    tag(dst, gamename)
 
-def remove_empty_dir_tree(path):
-    path = Path(path)
-    for child in path.glob("*"):
-        if child.is_dir():
-            remove_empty_dir_tree(child)
-            try:
-                child.rmdir()
-            except:
-                pass
+def copy_and_tag(src, dst, gamename, overwrite = False, linkmode = "copy", suffix = "", minduration = 0, cache = None,
+                 store = None):
+    """Copy src to dst with its album tag set, if it lasts at least minduration
+
+    src is parsed by mutagen once, for both its duration and its tags, which are
+    saved into a staged copy before it is renamed to dst, so dst is never seen
+    untagged or half written. Returns dst, or None if src is too short. With a
+    dedup.ContentStore in "skip" mode, dedup.Duplicate is raised if its audio
+    is already in the output path.
+    """
+    duration, mutafile = probe(src, cache)
+    if duration < minduration:
+        stats.count("files_dropped")
+        return None
+    if Path(dst).is_dir():
+        dst = Path(dst).joinpath(Path(src).name)
+    else:
+        Path(dst).parent.mkdir(parents=True, exist_ok=True)
+    if not overwrite and dst.exists():
+        # do not overwrite existing files
+        raise FileExistsError
+    # tagging leaves the audio alone, so src has the same hash as its tagged copy
+    holder = None if store is None else store.place(dedup.file_payload_hash(src), dst, overwrite)
+    if holder is not None:
+        if store.mode == "link":
+            return dst
+        raise dedup.Duplicate(holder)
+    temp_file, temp_path = stage(dst)
     try:
-        path.rmdir()
-    except:
-        pass
\ No newline at end of file
+        temp_file.close()
+        if linkmode == "reflink":
+            reflink_copy(src, temp_path)
+        else:
+            shutil.copy(src, temp_path)
+        if duration == float("inf"):
+            # not a sound file
+            pass
+        elif mutafile is None:
+            # the duration was cached, so src was not opened
+            tag(temp_path, gamename, suffix)
+        elif set_album(mutafile, gamename, suffix):
+            # the staged copy has the same layout as src, so its tags can be written into it
+            mutafile.save(temp_path)
+        if not overwrite and dst.exists():
+            raise FileExistsError
+        os.replace(temp_path, dst)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    stats.count("files_kept")
+    stats.count("bytes_read", os.stat(src).st_size)
+    stats.count("bytes_written", os.stat(dst).st_size)
+    return dst
@@ -0,0 +1,164 @@
+import fnmatch
+import functools
+import os
+import re
+
+from pathlib import Path, PurePath
+
+
+@functools.lru_cache()
+def compile_pattern(pattern):
+    """Match a single path component the way Path.glob does on this platform"""
+    flags = re.IGNORECASE if os.name == "nt" else 0
+    return re.compile(fnmatch.translate(pattern), flags).fullmatch
+
+
+def is_wildcard_pattern(pattern):
+    return "*" in pattern or "?" in pattern or "[" in pattern
+
+
+class IndexedEntry():
+    """The parts of an os.DirEntry that FolderIndex uses, read up front, as a DirEntry can't be pickled"""
+    def __init__(self, entry):
+        self.name = entry.name
+        self.path = entry.path
+        self.symlink = entry.is_symlink()
+        self.dir = FolderIndex.entry_is_dir(entry)
+        self.dir_nofollow = FolderIndex.entry_is_dir(entry, follow_symlinks=False)
+
+    def is_dir(self, follow_symlinks=True):
+        return self.dir if follow_symlinks else self.dir_nofollow
+
+    def is_symlink(self):
+        return self.symlink
+
+
+class FolderIndex():
+    """Directory listings and file stats under a folder, each read from disk at most once
+
+    glob() gives the same results in the same order as Path.glob on the folder,
+    but repeated and overlapping patterns are answered from the listings already
+    read, so a game folder is walked once however many steps and filespecs use it.
+    Directories are only listed once a pattern needs them. An index can be
+    pickled with what it has read so far, to be used in another process.
+    """
+    def __init__(self, root):
+        self.root = Path(root)
+        # normcased relative path parts -> list of os.DirEntry, or {normcased name: os.DirEntry}
+        self.listings = {}
+        self.names = {}
+        self.stats = {}
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["listings"] = {
+            key: [IndexedEntry(entry) if isinstance(entry, os.DirEntry) else entry for entry in entries]
+            for key, entries in self.listings.items()
+        }
+        state["names"] = {
+            key: {os.path.normcase(entry.name): entry for entry in entries}
+            for key, entries in state["listings"].items()
+        }
+        return state
+
+    def scandir(self, path, key):
+        entries = self.listings.get(key)
+        if entries is None:
+            try:
+                with os.scandir(path) as scandir_it:
+                    entries = list(scandir_it)
+            except OSError:
+                entries = []
+            self.listings[key] = entries
+            self.names[key] = {os.path.normcase(entry.name): entry for entry in entries}
+        return entries
+
+    def lookup(self, path, key, name):
+        self.scandir(path, key)
+        return self.names[key].get(os.path.normcase(name))
+
+    @staticmethod
+    def entry_is_dir(entry, follow_symlinks=True):
+        try:
+            return entry.is_dir(follow_symlinks=follow_symlinks)
+        except OSError:
+            return False
+
+    @staticmethod
+    def entry_exists(entry):
+        if entry.is_symlink():
+            return os.path.exists(entry.path)
+        return True
+
+    def stat(self, path):
+        """os.stat of a path under the folder, remembered for later calls"""
+        path = Path(path)
+        stat = self.stats.get(path)
+        if stat is None:
+            stat = self.stats[path] = os.stat(path)
+        return stat
+
+    def exists(self, pattern):
+        """Whether anything matches pattern"""
+        return next(self.glob(pattern), None) is not None
+
+    def glob(self, pattern):
+        """Path.glob(pattern) for the indexed folder"""
+        if not pattern:
+            raise ValueError("Unacceptable pattern: {!r}".format(pattern))
+        pure_pattern = PurePath(pattern)
+        if pure_pattern.anchor:
+            raise NotImplementedError("Non-relative patterns are unsupported")
+        pattern_parts = pure_pattern.parts
+        if pattern[-1] in (os.sep, os.altsep):
+            pattern_parts += ("",)
+        if not self.root.is_dir():
+            return iter([])
+        return self.select(pattern_parts, self.root, ())
+
+    def successor(self, child_parts, path, key):
+        if child_parts:
+            yield from self.select(child_parts, path, key)
+        else:
+            yield path
+
+    def select(self, pattern_parts, path, key):
+        """Mirrors the selectors of pathlib, one per pattern component"""
+        pattern = pattern_parts[0]
+        child_parts = pattern_parts[1:]
+        dironly = bool(child_parts)
+        if not pattern:
+            yield path
+        elif pattern == "**":
+            yielded = set()
+            for directory, directory_key in self.iterate_directories(path, key):
+                for found in self.successor(child_parts, directory, directory_key):
+                    if found not in yielded:
+                        yield found
+                        yielded.add(found)
+        elif "**" in pattern:
+            raise ValueError("Invalid pattern: '**' can only be an entire path component")
+        elif is_wildcard_pattern(pattern):
+            match = compile_pattern(pattern)
+            for entry in self.scandir(path, key):
+                if dironly and not self.entry_is_dir(entry):
+                    continue
+                if match(entry.name):
+                    yield from self.successor(
+                        child_parts, path / entry.name, key + (os.path.normcase(entry.name),)
+                    )
+        else:
+            entry = self.lookup(path, key, pattern)
+            if entry is not None and (self.entry_is_dir(entry) if dironly else self.entry_exists(entry)):
+                yield from self.successor(
+                    child_parts, path / pattern, key + (os.path.normcase(pattern),)
+                )
+
+    def iterate_directories(self, path, key):
+        """path and every directory below it in depth first order, not following symlinks"""
+        yield path, key
+        for entry in self.scandir(path, key):
+            if self.entry_is_dir(entry, follow_symlinks=False):
+                yield from self.iterate_directories(
+                    path / entry.name, key + (os.path.normcase(entry.name),)
+                )
@@ -1,21 +1,56 @@
+import os
+
 from pathlib import Path
 import pathvalidate
 
+import folder_index
+import manifest
+import output_registry
+
 class GameConfig():
-    def __init__(self, config, args, gamename, gamedata):
+    def __init__(self, config, args, gamename, gamedata, game_index = None):
         self.gamename = gamename
         # replace / with _ to make valid directory name
         self.output_game_path = Path(args.outputpath) / pathvalidate.sanitize_filename(gamename, "_")
+        # with --outputmode tar or zip, steps write to a local scratch folder instead,
+        # which is drained into this archive, see output_sink
+        self.output_archive_path = None
+        if args.outputmode != "dir":
+            self.output_archive_path = self.output_game_path.with_name(
+                self.output_game_path.name + "." + args.outputmode
+            )
+            self.output_game_path = (
+                Path(args.scratchpath) / f"vgm-extractor-{os.getpid()}" / self.output_game_path.name
+            )
         # TODO: support more platforms than steam
         game_folders = gamedata["game_folder"]
         if not isinstance(game_folders, list):
             game_folders = [game_folders]
-        self.game_folder = None
-        for steam_library_path in config.steam_library_paths:
-            for game_folder in game_folders:
-                game_folder = steam_library_path / "steamapps/common" / game_folder
-                if game_folder.is_dir():
-                    self.game_folder = game_folder
-                    break
-            if self.game_folder:
-                break
+        self.game_folder, self.installed_app = config.find_game_folder(game_folders)
+        # changes whenever Steam updates the game
+        self.buildid = self.installed_app.buildid if self.installed_app else None
+        # external tools run for this game, see steps.run_tool
+        self.tool_runs = []
+        # files and folders written during this run
+        self.outputs = output_registry.OutputRegistry(self.output_game_path)
+        # outputs of every game by the hash of their audio, with --dedup
+        self.content_store = config.content_store
+        self.manifest = None
+        self.game_index = None
+        if self.game_folder:
+            # shared by all steps, so the game folder is only walked once, and taken
+            # over from the parent process if it already walked it to plan the game
+            self.game_index = game_index
+            if game_index is None or game_index.root != self.game_folder:
+                self.game_index = folder_index.FolderIndex(self.game_folder)
+            self.manifest = manifest.Manifest(
+                self.output_game_path, self.game_folder,
+                {name: getattr(args, name) for name in manifest.OUTPUT_SETTINGS},
+                self.output_archive_path,
+            )
+
+    def output_exists(self):
+        """Whether the game has been extracted before, to its output folder or archive"""
+        if self.output_archive_path is not None:
+            return self.output_archive_path.exists()
+        return self.output_game_path.exists()
@@ -1,13 +1,36 @@
 from pathlib import Path
 import importlib.util
+import os
+import pickle
 import pkgutil
-import yaml
 import sys
 
-def load():
+# parsed yaml files are cached here, next to the compiled python gamedata modules
+BUNDLE_PATH = Path("__pycache__") / "gamedata.pickle"
+BUNDLE_VERSION = 1
+
+
+class LazyModule():
+    """A gamedata python module which is only executed once something is looked up in it"""
+    def __init__(self, spec):
+        self.spec = spec
+        self.module = None
+
+    def __getattr__(self, name):
+        if name in ("spec", "module"):
+            # not set yet, e.g. while unpickling
+            raise AttributeError(name)
+        if self.module is None:
+            self.module = importlib.util.module_from_spec(self.spec)
+            self.spec.loader.exec_module(self.module)
+        return getattr(self.module, name)
+
+
+def parse(data_file_paths):
+    import yaml
+
     game_data = {}
-    script_dir = Path(__file__).resolve().parent
-    for data_file_path in script_dir.glob("gamedata/*.yaml"):
+    for data_file_path in data_file_paths:
         name = data_file_path.stem
         with open(data_file_path, "r") as data_file:
             game_data[name] = yaml.safe_load(data_file.read())
@@ -16,11 +39,53 @@ def load():
         if name != game_data[name]["game_name"]:
             game_data[game_data[name]["game_name"]] = game_data[name]
             del game_data[name]
+    return game_data
+
+
+def load_bundle(bundle_path, stamps):
+    """Game data from the bundle if it was built from the yaml files described by stamps"""
+    try:
+        with open(bundle_path, "rb") as bundle_file:
+            bundle = pickle.load(bundle_file)
+        if bundle["version"] == BUNDLE_VERSION and bundle["stamps"] == stamps:
+            return bundle["game_data"]
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError, TypeError):
+        pass
+    return None
+
+
+def save_bundle(bundle_path, stamps, game_data):
+    try:
+        bundle_path.parent.mkdir(exist_ok=True)
+        temp_path = bundle_path.with_name(bundle_path.name + str(os.getpid()))
+        with open(temp_path, "wb") as bundle_file:
+            pickle.dump(
+                {"version": BUNDLE_VERSION, "stamps": stamps, "game_data": game_data},
+                bundle_file,
+                pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(temp_path, bundle_path)
+    except OSError:
+        # e.g. a read only install, the yaml files are parsed again next time
+        pass
+
+
+def load():
+    script_dir = Path(__file__).resolve().parent
+    data_dir = script_dir / "gamedata"
+    data_file_paths = sorted(data_dir.glob("*.yaml"))
+    # the bundle is rebuilt when any yaml file is added, removed or modified
+    stamps = {}
+    for data_file_path in data_file_paths:
+        stat = data_file_path.stat()
+        stamps[data_file_path.name] = (stat.st_mtime_ns, stat.st_size)
+    game_data = load_bundle(data_dir / BUNDLE_PATH, stamps)
+    if game_data is None:
+        game_data = parse(data_file_paths)
+        save_bundle(data_dir / BUNDLE_PATH, stamps, game_data)
 
     # TODO replace deprecated find_module and load_module
-    for finder, name, ispkg in pkgutil.iter_modules([str(script_dir / "gamedata")]):
-        spec = finder.find_spec(name)
-        game_data[name]["python"] = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(game_data[name]["python"])
+    for finder, name, ispkg in pkgutil.iter_modules([str(data_dir)]):
+        game_data[name]["python"] = LazyModule(finder.find_spec(name))
 
     return game_data
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+"""Compares per-name fnmatch loops with a compiled FilespecMatcher on a large zip archive"""
+
+import argparse
+import fnmatch
+import io
+import sys
+import time
+
+from pathlib import Path
+from zipfile import ZipFile
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import steps  # noqa: E402
+
+
+def fnmatch_filter(filenames, filespecs, excludespecs):
+    """The filtering ZipfileStep used to do, one fnmatch call per name and spec"""
+    kept = []
+    for filename in filenames:
+        filespecs_list = steps.filespecify(filespecs)
+        excludespecs_list = steps.listify(excludespecs)
+        if any(fnmatch.fnmatch(filename, spec) for spec in excludespecs_list):
+            continue
+        if any(fnmatch.fnmatch(filename, spec) for spec in filespecs_list):
+            kept.append(filename)
+    return kept
+
+
+def build_zip(members):
+    buffer = io.BytesIO()
+    with ZipFile(buffer, "w") as zipfile:
+        for index in range(members):
+            folder = ("tmp/sound/music", "tmp/sound/sfx", "tmp/model/truck", "tmp/ui")[index % 4]
+            extension = (".ogg", ".wav", ".pmg", ".png")[index % 3]
+            zipfile.writestr(f"{folder}/file{index}{extension}", b"")
+    buffer.seek(0)
+    return buffer
+
+
+def best_time(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+arg_parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+arg_parser.add_argument("--members", type=int, default=100000, help="number of zip members")
+arg_parser.add_argument("--repeat", type=int, default=3, help="timing runs, the best is reported")
+args = arg_parser.parse_args()
+
+filespecs = ["tmp/sound/music/*.ogg", "tmp/sound/music/*.wav", "tmp/ui/logo*.png"]
+excludespecs = ["tmp/sound/music/truck_dealer.ogg", "*/file1?.*"]
+
+with ZipFile(build_zip(args.members)) as zipfile:
+    names = zipfile.namelist()
+
+fnmatch_time, fnmatch_kept = best_time(lambda: fnmatch_filter(names, filespecs, excludespecs), args.repeat)
+matcher_time, matcher_kept = best_time(
+    lambda: steps.FilespecMatcher(filespecs, excludespecs).filter(names), args.repeat
+)
+assert fnmatch_kept == matcher_kept
+
+print(f"{len(names)} members, {len(matcher_kept)} kept")
+print(f"fnmatch loop:     {fnmatch_time * 1000:8.1f} ms")
+print(f"FilespecMatcher:  {matcher_time * 1000:8.1f} ms")
+print(f"speedup:          {fnmatch_time / matcher_time:8.1f}x")
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+"""Runs the whole extraction over a fake Steam library, reporting startup time, per step throughput and peak RSS
+
+The library is built with make_fake_library.py unless --root points to one built
+before. Games are extracted serially in this process, so every step can be timed.
+Arguments after -- are passed on to vgm-extractor.py, for example -- --linkmode reflink.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+
+from sys import platform
+if platform.startswith("win"):
+    resource = None
+else:
+    import resource
+
+script_dir = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(script_dir))
+import args as vgmx_args  # noqa: E402
+import config  # noqa: E402
+import extraction  # noqa: E402
+import gamedata  # noqa: E402
+import steps  # noqa: E402
+
+
+class StepTotals():
+    def __init__(self):
+        self.runs = 0
+        self.seconds = 0
+        self.files = 0
+        self.bytes = 0
+
+
+def output_files(path):
+    """Modification time and size of every file under path"""
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            stat = os.stat(os.path.join(dirpath, filename))
+            files[os.path.join(dirpath, filename)] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+def timed_run(step_class, totals):
+    """Step.run of step_class, also adding its time and the files it wrote to totals"""
+    run = step_class.run
+
+    def wrapper(self, configuration, args, gameconfig):
+        before = output_files(gameconfig.output_game_path)
+        start = time.perf_counter()
+        try:
+            return run(self, configuration, args, gameconfig)
+        finally:
+            seconds = time.perf_counter() - start
+            step_totals = totals.setdefault(step_class.__name__, StepTotals())
+            step_totals.runs += 1
+            step_totals.seconds += seconds
+            for path, (mtime, size) in output_files(gameconfig.output_game_path).items():
+                if before.get(path, (None, None))[0] != mtime:
+                    step_totals.files += 1
+                    step_totals.bytes += size
+    return wrapper
+
+
+def peak_rss_mb(who):
+    # kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / 1024 / 1024 if platform == "darwin" else peak / 1024
+
+
+arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+arg_parser.add_argument("--root", type=Path, help="fake Steam library built by make_fake_library.py")
+arg_parser.add_argument("--scale", type=int, default=3, help="files per wildcard filespec when building a library")
+arg_parser.add_argument("--seconds", type=float, default=60, help="duration of each music file when building a library")
+arg_parser.add_argument("extractor_args", nargs="*", help="more vgm-extractor.py arguments, after --")
+args = arg_parser.parse_args()
+
+with tempfile.TemporaryDirectory() as temp_dir:
+    root = args.root
+    if root is None:
+        root = Path(temp_dir) / "steam"
+        start = time.perf_counter()
+        subprocess.run(
+            [
+                sys.executable, str(Path(__file__).resolve().parent / "make_fake_library.py"), str(root),
+                "--scale", str(args.scale), "--seconds", str(args.seconds),
+            ],
+            check=True,
+        )
+        print(f"library built in {time.perf_counter() - start:.1f} s")
+    output_path = Path(temp_dir) / "output"
+    output_path.mkdir()
+    # found through ~/.steam/steam/config/libraryfolders.vdf, as on a real install
+    os.environ["HOME"] = str(root / "home")
+    sys.argv = ["vgm-extractor.py", "--outputpath", str(output_path)] + args.extractor_args
+
+    start = time.perf_counter()
+    parsed_args = vgmx_args.parse()
+    game_data = gamedata.load()
+    configuration = config.Config(parsed_args, game_data)
+    startup = time.perf_counter() - start
+
+    totals = {}
+    for step_class in set(steps.StepFuncs.values()):
+        step_class.run = timed_run(step_class, totals)
+    parsed_args.jobs = 1
+    start = time.perf_counter()
+    results = list(extraction.extract_games(configuration, parsed_args))
+    pipeline = time.perf_counter() - start
+    failures = [result for result in results if result.error]
+    extracted = sum(1 for result in results if result.extracted)
+
+print(f"startup (arguments, gamedata, config)  {startup * 1000:8.1f} ms")
+print(f"extraction of {extracted} games          {pipeline:8.2f} s, {len(failures)} failed")
+print()
+print(f"{'step':24} {'runs':>6} {'seconds':>9} {'files':>7} {'MB':>9} {'files/s':>9} {'MB/s':>8}")
+for name, step_totals in sorted(totals.items(), key=lambda item: -item[1].seconds):
+    megabytes = step_totals.bytes / 1024 / 1024
+    seconds = max(step_totals.seconds, 0.000001)
+    print(
+        f"{name:24} {step_totals.runs:6} {step_totals.seconds:9.3f} {step_totals.files:7} {megabytes:9.1f}"
+        f" {step_totals.files / seconds:9.1f} {megabytes / seconds:8.1f}"
+    )
+print()
+if resource is not None:
+    print(
+        f"peak RSS {peak_rss_mb(resource.RUSAGE_SELF):.1f} MB, largest child process"
+        f" {peak_rss_mb(resource.RUSAGE_CHILDREN):.1f} MB (tools, and make_fake_library.py if it ran)"
+    )
+for result in failures:
+    print(result.game_name + ": " + result.error.splitlines()[-1])
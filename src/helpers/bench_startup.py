@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+"""Times gamedata.load() and a whole vgm-extractor.py run for one game, with and without the gamedata bundle"""
+
+import argparse
+import subprocess
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+
+script_dir = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(script_dir))
+import gamedata  # noqa: E402
+
+bundle_path = script_dir / "gamedata" / gamedata.BUNDLE_PATH
+
+
+def remove_bundle():
+    try:
+        bundle_path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def best_time(func, repeat, cold):
+    best = float("inf")
+    for _ in range(repeat):
+        if cold:
+            remove_bundle()
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+arg_parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+arg_parser.add_argument("game", nargs="?", default="Factorio", help="game to ask vgm-extractor.py for")
+arg_parser.add_argument("--repeat", type=int, default=5, help="timing runs, the best is reported")
+args = arg_parser.parse_args()
+
+with tempfile.TemporaryDirectory() as temp_dir:
+    # an empty library, so the run measures startup rather than extraction
+    output_path = Path(temp_dir) / "output"
+    library_path = Path(temp_dir) / "library"
+    output_path.mkdir()
+    (library_path / "steamapps").mkdir(parents=True)
+    command = [
+        sys.executable, str(script_dir / "vgm-extractor.py"),
+        "--outputpath", str(output_path), "--steamlibrarypath", str(library_path), args.game,
+    ]
+
+    def run():
+        subprocess.run(command, check=True)
+
+    results = [
+        ("gamedata.load(), parsing yaml", best_time(gamedata.load, args.repeat, cold=True)),
+        ("gamedata.load(), from bundle", best_time(gamedata.load, args.repeat, cold=False)),
+        ("vgm-extractor.py " + args.game + ", parsing yaml", best_time(run, args.repeat, cold=True)),
+        ("vgm-extractor.py " + args.game + ", from bundle", best_time(run, args.repeat, cold=False)),
+    ]
+
+for name, seconds in results:
+    print(f"{name:50} {seconds * 1000:8.1f} ms")
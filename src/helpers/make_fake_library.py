@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+
+"""Builds a fake Steam installation and library from the gamedata, with tiny valid music files
+
+The result has a Steam folder with config/libraryfolders.vdf, a library with an
+appmanifest and a game folder for every game whose extract steps can be satisfied
+without third party tools, and home/.steam/steam linking to the Steam folder, so
+vgm-extractor.py finds it all with HOME=<root>/home or --steamlibrarypath <root>/library.
+"""
+
+import argparse
+import io
+import re
+import struct
+import sys
+import wave
+
+from pathlib import Path
+from zipfile import ZipFile
+
+import vdf
+
+from mutagen.ogg import OggPage
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import gamedata  # noqa: E402
+import steps  # noqa: E402
+
+# steps which read the game folder and can be given files here, or only rework earlier output
+GENERATED_STEPS = ["filespec", "zipfile", "vpkfile", "xwb_file"]
+OUTPUT_STEPS = ["tag_filespec", "filterfilespec", "flattenfilespec"]
+FIRST_APPID = 1000000
+
+
+def opus(seconds):
+    """An Ogg Opus stream with only its headers and a final page giving its length"""
+    pages = []
+    for sequence, packet in enumerate([
+        b"OpusHead" + struct.pack("<BBHIhB", 1, 2, 312, 48000, 0, 0),
+        b"OpusTags" + struct.pack("<I", 4) + b"vgmx" + struct.pack("<I", 0),
+        b"\xfc\xff\xfe",
+    ]):
+        page = OggPage()
+        page.serial = 1
+        page.sequence = sequence
+        page.first = sequence == 0
+        page.last = sequence == 2
+        page.packets = [packet]
+        page.position = int(seconds * 48000) + 312 if page.last else 0
+        pages.append(page)
+    return b"".join(page.write() for page in pages)
+
+
+def mp3(seconds):
+    """Three MPEG frames, the first a Xing header giving the frame count"""
+    frame = bytearray(417)
+    frame[:4] = b"\xff\xfb\x90\x64"
+    xing = bytearray(frame)
+    xing[36:48] = b"Xing" + struct.pack(">II", 1, int(seconds * 44100 / 1152))
+    return bytes(xing) + bytes(frame) * 2
+
+
+def flac(seconds):
+    """A FLAC stream with only its STREAMINFO block"""
+    samples = int(44100 * seconds)
+    streaminfo = struct.pack(">HH", 4096, 4096) + bytes(6)
+    # 20 bits of sample rate, 3 of channels - 1, 5 of bits per sample - 1, 36 of samples
+    streaminfo += (44100 << 44 | 1 << 41 | 15 << 36 | samples).to_bytes(8, "big") + bytes(16)
+    return b"fLaC" + bytes([0x80]) + len(streaminfo).to_bytes(3, "big") + streaminfo
+
+
+def pcm(seconds):
+    """Silent 8 bit mono samples at 8 kHz"""
+    return b"\x80" * int(8000 * seconds)
+
+
+def wav(seconds):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wave_file:
+        wave_file.setnchannels(1)
+        wave_file.setsampwidth(1)
+        wave_file.setframerate(8000)
+        wave_file.writeframes(pcm(seconds))
+    return buffer.getvalue()
+
+
+def file_contents(name, seconds):
+    suffix = Path(name).suffix.lower()
+    if suffix in (".ogg", ".opus"):
+        return opus(seconds)
+    if suffix == ".mp3":
+        return mp3(seconds)
+    if suffix == ".wav":
+        return wav(seconds)
+    if suffix == ".flac":
+        return flac(seconds)
+    return b"vgmx " + name.encode()
+
+
+def materialize(pattern, number):
+    """A path matching a glob pattern, different for each number where the pattern has wildcards"""
+    def replace(match):
+        token = match.group(0)
+        if token == "**":
+            return "deep"
+        if token == "*":
+            return f"vgmx{number}"
+        if token == "?":
+            return "x"
+        # a character set, its first character, or any other for a negated set
+        members = token[1:-1]
+        if members.startswith("!"):
+            return "~" if "~" not in members else "_"
+        return members[0]
+    name = re.sub(r"\*\*|\*|\?|\[!?\]?[^]]*\]", replace, pattern)
+    if pattern.endswith("*") and not Path(name).suffix:
+        # any file name would do, give it a music extension
+        name += ".ogg"
+    return name
+
+
+def matching_names(filespecs, count):
+    names = []
+    for filespec in steps.filespecify(filespecs):
+        if any(character in filespec for character in "*?["):
+            names.extend(materialize(filespec, number) for number in range(count))
+        else:
+            names.append(filespec)
+    return names
+
+
+def vpk(files):
+    """A version 2 VPK directory file holding files, and its single chunk file"""
+    tree = bytearray()
+    chunk = bytearray()
+    by_extension = {}
+    for path, data in files.items():
+        folder, _, name = path.rpartition("/")
+        stem, dot, extension = name.rpartition(".")
+        if not dot:
+            stem, extension = name, " "
+        by_extension.setdefault(extension, {}).setdefault(folder or " ", []).append((stem, data))
+    for extension, folders in by_extension.items():
+        tree += extension.encode() + b"\0"
+        for folder, names in folders.items():
+            tree += folder.encode() + b"\0"
+            for name, data in names:
+                tree += name.encode() + b"\0" + struct.pack("<IHHIIH", 0, 0, 0, len(chunk), len(data), 0xFFFF)
+                chunk += data
+            tree += b"\0"
+        tree += b"\0"
+    tree += b"\0"
+    return struct.pack("<IIIIIII", 0x55AA1234, 2, len(tree), 0, 0, 0, 0) + tree, bytes(chunk)
+
+
+def xwb(count, seconds):
+    """An XACT wave bank with count silent PCM entries"""
+    data = pcm(seconds)
+    mini_format = 1 << 2 | 8000 << 5 | 1 << 23
+    metadata = b"".join(
+        struct.pack("<IIIIII", int(8000 * seconds) << 4, mini_format, index * len(data), len(data), 0, 0)
+        for index in range(count)
+    )
+    bank = struct.pack("<II64sIIII", 0, count, b"vgmx", 24, 64, 1, mini_format) + bytes(8)
+    segments = [bank, metadata, b"", b""]
+    offset = 12 + 5 * 8
+    table = []
+    for segment in segments:
+        table.append((offset, len(segment)))
+        offset += len(segment)
+    table.append((offset, len(data) * count))
+    header = struct.pack("<4sII", b"WBND", 46, 44) + b"".join(struct.pack("<II", *entry) for entry in table)
+    return header + b"".join(segments) + data * count
+
+
+def write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+
+
+def build_game(game_path, extract_steps, args):
+    """Create the files the extract steps read, returning the number of files written"""
+    written = 0
+    for step in extract_steps:
+        if "filespec" in step:
+            for name in matching_names(step["filespec"], args.scale):
+                write(game_path / name, file_contents(name, args.seconds))
+                written += 1
+        elif "zipfile" in step:
+            (game_path / step["zipfile"]).parent.mkdir(parents=True, exist_ok=True)
+            with ZipFile(game_path / step["zipfile"], "w") as zipfile:
+                for name in matching_names(step["zipfilespec"], args.scale):
+                    zipfile.writestr(name, file_contents(name, args.seconds))
+                    written += 1
+                for number in range(args.noise):
+                    zipfile.writestr(f"vgmx-noise/file{number}.dat", b"noise")
+        elif "vpkfile" in step:
+            files = {
+                name: file_contents(name, args.seconds)
+                for name in matching_names(step["vpkfilespec"], args.scale)
+            }
+            files.update({f"vgmx-noise/file{number}.dat": b"noise" for number in range(args.noise)})
+            directory, chunk = vpk(files)
+            dir_path = game_path / step["vpkfile"]
+            write(dir_path, directory)
+            write(dir_path.with_name(dir_path.name.replace("_dir", "_000")), chunk)
+            written += len(files)
+        elif "xwb_file" in step:
+            write(game_path / step["xwb_file"], xwb(args.scale, args.seconds))
+            if "xsb_file" in step:
+                names = b"".join(f"vgmx{number}\0".encode() for number in range(args.scale))
+                write(game_path / step["xsb_file"], bytes(step.get("xsb_offset", 0)) + names)
+            written += args.scale
+    return written
+
+
+arg_parser = argparse.ArgumentParser(
+    description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter
+)
+arg_parser.add_argument("root", type=Path, help="folder to create the Steam installation and library in")
+arg_parser.add_argument("--scale", type=int, default=3, help="files created for each wildcard filespec")
+arg_parser.add_argument("--seconds", type=float, default=60, help="duration of each music file")
+arg_parser.add_argument("--noise", type=int, default=20, help="unmatched members added to each archive")
+arg_parser.add_argument("games", nargs="*", help="games to create, all those possible by default")
+args = arg_parser.parse_args()
+
+game_data = gamedata.load()
+steam_path = args.root / "steam"
+library_path = args.root / "library"
+(steam_path / "config").mkdir(parents=True, exist_ok=True)
+(library_path / "steamapps" / "common").mkdir(parents=True, exist_ok=True)
+(args.root / "home" / ".steam").mkdir(parents=True, exist_ok=True)
+steam_link = args.root / "home" / ".steam" / "steam"
+if not steam_link.is_symlink():
+    steam_link.symlink_to(steam_path.resolve())
+with open(steam_path / "config" / "libraryfolders.vdf", "w") as vdf_file:
+    vdf.dump({"libraryfolders": {"0": {"path": str(library_path.resolve())}}}, vdf_file, pretty=True)
+
+games = args.games or sorted(game_data)
+created = 0
+skipped = []
+files = 0
+for appid, game_name in enumerate(games, FIRST_APPID):
+    data = game_data[game_name]
+    step_keys = [key for step in data["extract_steps"] for key in step if key in steps.StepFuncs]
+    if not step_keys or any(key not in GENERATED_STEPS + OUTPUT_STEPS for key in step_keys):
+        skipped.append(game_name)
+        continue
+    installdir = steps.listify(data["game_folder"])[0]
+    files += build_game(library_path / "steamapps" / "common" / installdir, data["extract_steps"], args)
+    with open(library_path / "steamapps" / f"appmanifest_{appid}.acf", "w") as acf_file:
+        vdf.dump({"AppState": {
+            "appid": str(appid), "name": game_name, "StateFlags": "4",
+            "installdir": installdir, "buildid": "1",
+        }}, acf_file, pretty=True)
+    created += 1
+
+print(f"{created} games with {files} files in {library_path}")
+if skipped:
+    print(f"{len(skipped)} games skipped, their steps need third party tools or formats: " + ", ".join(skipped))
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import threading
+
+from pathlib import Path
+
+MANIFEST_NAME = ".vgmx-manifest.json"
+# arguments deciding which outputs a source produces and what they hold
+OUTPUT_SETTINGS = ["format", "minduration", "albumsuffix", "convertwav", "dedup"]
+
+
+def file_hash(path):
+    """sha256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest():
+    """Sources each step of a game was extracted from, and the output files they produced
+
+    Entries are keyed by step index and source path relative to the game folder,
+    and record the source size and mtime and a hash of the output settings, along
+    with the output paths relative to the output game path and a hash of each
+    output's contents. An output left out by --dedup skip records the output
+    holding its audio instead. With archive_path, the manifest is kept beside
+    that archive instead, as the output game path is only a scratch folder.
+    """
+    def __init__(self, output_game_path, game_folder, settings = None, archive_path = None):
+        self.path = Path(output_game_path) / MANIFEST_NAME
+        self.archive_path = None
+        if archive_path is not None:
+            self.archive_path = Path(archive_path)
+            self.path = self.archive_path.with_name(self.archive_path.name + MANIFEST_NAME)
+        self.output_game_path = Path(output_game_path)
+        self.game_folder = Path(game_folder)
+        self.settings_hash = hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+        self.entries = {}
+        # keys of entries recorded during this run
+        self.dirty = set()
+        # whether any step produced or refreshed output during this run
+        self.changed = False
+        self.lock = threading.Lock()
+        # Steam build of the game and hash of its extract steps when it was last extracted
+        self.buildid = None
+        self.steps_hash = None
+        try:
+            with open(self.path) as manifest_file:
+                manifest = json.load(manifest_file)
+            self.entries = manifest["entries"]
+            self.buildid = manifest.get("buildid")
+            self.steps_hash = manifest.get("steps_hash")
+        except (OSError, ValueError, KeyError):
+            pass
+
+    @staticmethod
+    def hash_steps(extract_steps):
+        return hashlib.sha256(json.dumps(extract_steps, sort_keys=True).encode()).hexdigest()
+
+    def is_build_current(self, buildid, extract_steps):
+        """Whether the game was last extracted from this Steam build with these extract steps and settings,
+        and every output is still there"""
+        return (
+            buildid is not None
+            and buildid == self.buildid
+            and self.hash_steps(extract_steps) == self.steps_hash
+            and all(
+                entry.get("settings") == self.settings_hash and self.outputs_exist(entry)
+                for entry in self.entries.values()
+            )
+        )
+
+    def set_build(self, buildid, extract_steps):
+        self.buildid = buildid
+        self.steps_hash = self.hash_steps(extract_steps)
+
+    def key(self, step_index, source):
+        return str(step_index) + ":" + Path(source).relative_to(self.game_folder).as_posix()
+
+    def outputs_exist(self, entry):
+        if self.archive_path is not None:
+            # every output went into the archive
+            return self.archive_path.exists()
+        return all(
+            (self.output_game_path / output.get("duplicate_of", output["path"])).exists()
+            for output in entry["outputs"]
+        )
+
+    def is_current(self, step_index, source, stat = None):
+        """Whether source is unchanged since it was recorded and all of its outputs still exist"""
+        entry = self.entries.get(self.key(step_index, source))
+        if entry is None or self.archive_path is not None:
+            # an archive is always written whole, so it needs every source again
+            return False
+        try:
+            stat = stat or os.stat(source)
+        except OSError:
+            return False
+        if entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime_ns:
+            return False
+        if entry.get("settings") != self.settings_hash:
+            # e.g. a lower --minduration keeps files that were dropped before
+            return False
+        # outputs deleted since the last run are extracted again
+        return self.outputs_exist(entry)
+
+    def record(self, step_index, source, outputs, stat = None, duplicates = None):
+        """Record the outputs of source, and the outputs in duplicates left out for the output holding their audio"""
+        stat = stat or os.stat(source)
+        key = self.key(step_index, source)
+        with self.lock:
+            self.entries[key] = {
+                "source": Path(source).relative_to(self.game_folder).as_posix(),
+                "step": step_index,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+                "settings": self.settings_hash,
+                "outputs": [
+                    {"path": Path(output).relative_to(self.output_game_path).as_posix()}
+                    for output in outputs
+                ] + [
+                    {
+                        "path": Path(output).relative_to(self.output_game_path).as_posix(),
+                        # the holder may be in the output path of another game
+                        "duplicate_of": Path(os.path.relpath(holder, self.output_game_path)).as_posix(),
+                    }
+                    for output, holder in (duplicates or {}).items()
+                ],
+            }
+            self.dirty.add(key)
+            self.changed = True
+
+    def rename_output(self, old, new):
+        old = Path(old).relative_to(self.output_game_path).as_posix()
+        new = Path(new).relative_to(self.output_game_path).as_posix()
+        with self.lock:
+            for key in self.dirty:
+                for output in self.entries[key]["outputs"]:
+                    if output["path"] == old:
+                        output["path"] = new
+
+    def snapshot(self):
+        """Modification times of every file currently under the output game path"""
+        files = {}
+        for dirpath, dirnames, filenames in os.walk(self.output_game_path):
+            for filename in filenames:
+                path = Path(dirpath) / filename
+                if path != self.path:
+                    files[path] = path.stat().st_mtime_ns
+        return files
+
+    def new_outputs(self, before):
+        """Files created or modified since snapshot() returned before"""
+        return [path for path, mtime in self.snapshot().items() if before.get(path) != mtime]
+
+    def has_outputs(self):
+        return any(entry["outputs"] for entry in self.entries.values())
+
+    def save(self, archived = ()):
+        """Write the manifest, keeping the outputs still in the output game path or whose paths are in archived"""
+        for key in self.dirty:
+            # drop outputs that later steps of this run filtered out, and hash the rest
+            outputs = []
+            for output in self.entries[key]["outputs"]:
+                path = self.output_game_path / output["path"]
+                if "duplicate_of" in output:
+                    if (self.output_game_path / output["duplicate_of"]).is_file():
+                        outputs.append(output)
+                elif path.is_file():
+                    output["hash"] = file_hash(path)
+                    outputs.append(output)
+                elif output["path"] in archived:
+                    outputs.append(output)
+            self.entries[key]["outputs"] = outputs
+        self.dirty = set()
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(temp_path, "w") as manifest_file:
+            json.dump(
+                {"buildid": self.buildid, "steps_hash": self.steps_hash, "entries": self.entries},
+                manifest_file, indent=1, sort_keys=True,
+            )
+        os.replace(temp_path, self.path)
+
+    def remove(self):
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,130 @@
+import os
+import threading
+
+from pathlib import Path, PurePosixPath
+
+import folder_index
+
+
+def match_parts(pattern_parts, path_parts, is_dir):
+    """Whether relative path parts match glob pattern parts the way Path.glob would find them"""
+    if not pattern_parts:
+        return not path_parts
+    head = pattern_parts[0]
+    if head == "**":
+        if len(pattern_parts) == 1:
+            # a trailing ** only finds folders
+            return is_dir
+        return any(
+            match_parts(pattern_parts[1:], path_parts[start:], is_dir)
+            for start in range(len(path_parts))
+        )
+    if not path_parts or not folder_index.compile_pattern(head)(path_parts[0]):
+        return False
+    return match_parts(pattern_parts[1:], path_parts[1:], is_dir)
+
+
+class OutputRegistry():
+    """Files and folders written under a game's output path during this run
+
+    Steps register what they write, or what an external tool wrote, so later
+    steps, wav conversion and the removal of empty folders work from here
+    instead of walking the output path again. Files left by earlier runs are
+    not included.
+    """
+    def __init__(self, output_game_path):
+        self.root = Path(output_game_path)
+        # dicts keep registration order
+        self.files = {}
+        self.dirs = {}
+        # files left out by --dedup skip, with the output holding the same audio
+        self.duplicates = {}
+        # every file registered, in order, for added_since()
+        self.added = []
+        self.lock = threading.Lock()
+
+    def add_parents(self, path):
+        for parent in path.parents:
+            if parent == self.root or self.root not in parent.parents:
+                break
+            self.dirs[parent] = None
+
+    def add(self, path):
+        path = Path(path)
+        with self.lock:
+            self.files[path] = None
+            self.added.append(path)
+            self.add_parents(path)
+
+    def add_all(self, paths):
+        for path in paths:
+            self.add(path)
+
+    def add_duplicate(self, path, holder):
+        """Register a file that was not written, as holder has the same audio"""
+        path = Path(path)
+        with self.lock:
+            self.duplicates[path] = Path(holder)
+            self.added.append(path)
+
+    def mkdir(self, path):
+        """Create a folder and its parents, registering them"""
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        with self.lock:
+            if path != self.root:
+                self.dirs[path] = None
+            self.add_parents(path)
+
+    def remove(self, path):
+        with self.lock:
+            self.files.pop(Path(path), None)
+            self.dirs.pop(Path(path), None)
+
+    def rename(self, old, new):
+        with self.lock:
+            self.files.pop(Path(old), None)
+        self.add(new)
+
+    def file_list(self):
+        with self.lock:
+            return list(self.files)
+
+    def mark(self):
+        return len(self.added)
+
+    def added_since(self, mark):
+        """Files registered after mark() returned mark that are still there, in order"""
+        with self.lock:
+            return [path for path in dict.fromkeys(self.added[mark:]) if path in self.files]
+
+    def duplicates_since(self, mark):
+        """Files registered with add_duplicate() after mark() returned mark, with their holders"""
+        with self.lock:
+            return {path: self.duplicates[path] for path in self.added[mark:] if path in self.duplicates}
+
+    def glob(self, pattern):
+        """Registered files and folders matching pattern, like Path.glob on the output path"""
+        pattern_parts = PurePosixPath(pattern).parts
+        with self.lock:
+            candidates = [(path, False) for path in self.files] + [(path, True) for path in self.dirs]
+        for path, is_dir in candidates:
+            if match_parts(pattern_parts, path.relative_to(self.root).parts, is_dir):
+                yield path
+
+    def remove_empty_dirs(self):
+        """Remove the registered folders, deepest first, that no longer hold anything, then the output path"""
+        with self.lock:
+            # folders still holding registered files are skipped without asking the filesystem
+            occupied = {parent for path in self.files for parent in path.parents}
+            dirs = sorted(self.dirs, key=lambda path: len(path.parts), reverse=True)
+        for path in dirs + [self.root]:
+            if path in occupied:
+                continue
+            try:
+                os.rmdir(path)
+            except OSError:
+                # not empty, or already gone
+                continue
+            with self.lock:
+                self.dirs.pop(path, None)
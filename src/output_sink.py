@@ -0,0 +1,106 @@
+import io
+import json
+import os
+import tarfile
+import zipfile
+
+from pathlib import Path
+
+INDEX_NAME = ".vgmx-index.json"
+
+
+class DirSink():
+    """Outputs stay where the steps wrote them, under the output path"""
+    # names of the outputs moved elsewhere
+    names = frozenset()
+
+    def drain(self, outputs, hold = None):
+        pass
+
+    def close(self):
+        pass
+
+    def abort(self):
+        pass
+
+
+class ArchiveSink():
+    """Moves a game's outputs from its scratch folder into a single tar or uncompressed zip
+
+    The archive is written sequentially beside its final path and renamed into
+    place by close(), so a half written archive is never mistaken for a finished
+    one. A zip indexes its members in its central directory, a tar gets a json
+    index of member names, data offsets and sizes as its last member.
+
+    Every step writes to the scratch folder, plain copies included: mutagen tags
+    a copy of the file it can seek in and tell the format of by name, and later
+    steps may still rename or filter it. On a local scratch drive that costs one
+    local write per track, while the output path only sees the archive.
+    """
+    def __init__(self, archive_path, scratch_path, mode):
+        self.archive_path = Path(archive_path)
+        self.scratch_path = Path(scratch_path)
+        self.temp_path = self.archive_path.with_name("." + self.archive_path.name + ".tmp")
+        self.mode = mode
+        self.archive = None
+        self.names = set()
+        self.index = []
+
+    def open(self):
+        if self.mode == "tar":
+            self.archive = tarfile.open(self.temp_path, "w", format=tarfile.PAX_FORMAT)
+        else:
+            self.archive = zipfile.ZipFile(self.temp_path, "w", zipfile.ZIP_STORED)
+
+    def add(self, path, name):
+        if self.archive is None:
+            self.open()
+        if self.mode == "tar":
+            info = self.archive.gettarinfo(path, name)
+            with open(path, "rb") as file:
+                self.archive.addfile(info, file)
+            # the data ends the archive so far, padded to whole blocks
+            blocks = -(-info.size // tarfile.BLOCKSIZE)
+            offset = self.archive.offset - blocks * tarfile.BLOCKSIZE
+            self.index.append({"name": name, "offset": offset, "size": info.size})
+        else:
+            self.archive.write(path, name)
+        self.names.add(name)
+
+    def drain(self, outputs, hold = None):
+        """Move every file in the output registry into the archive, except those hold() is true for"""
+        for path in sorted(outputs.file_list()):
+            if hold is not None and hold(path):
+                continue
+            if path.is_file():
+                name = path.relative_to(self.scratch_path).as_posix()
+                # the first file written under a name is kept, as without --overwrite in a folder
+                if name not in self.names:
+                    self.add(path, name)
+                os.unlink(path)
+            outputs.remove(path)
+
+    def close(self):
+        if self.archive is None:
+            # nothing was kept, so there is no archive, just as an empty output folder is removed
+            return
+        if self.mode == "tar":
+            index = json.dumps(self.index, indent=1).encode()
+            info = tarfile.TarInfo(INDEX_NAME)
+            info.size = len(index)
+            self.archive.addfile(info, io.BytesIO(index))
+        self.archive.close()
+        self.archive = None
+        os.replace(self.temp_path, self.archive_path)
+
+    def abort(self):
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+        self.temp_path.unlink(missing_ok=True)
+
+
+def make_sink(args, gameconfig):
+    if gameconfig.output_archive_path is None:
+        return DirSink()
+    return ArchiveSink(gameconfig.output_archive_path, gameconfig.output_game_path, args.outputmode)
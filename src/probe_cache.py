@@ -0,0 +1,53 @@
+import time
+
+from pathlib import Path
+
+import thread_sqlite
+
+CACHE_NAME = ".vgmx-probes.sqlite"
+# entries that have not been looked up for this long are evicted
+EXPIRY_SECONDS = 90 * 24 * 60 * 60
+# how stale an entry's last use may get before a lookup records it again
+TOUCH_SECONDS = 24 * 60 * 60
+
+
+class ProbeCache():
+    """Audio durations and formats kept between runs, keyed by path, size and mtime
+
+    Each thread gets its own sqlite connection, see thread_sqlite.
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self.connections = thread_sqlite.ThreadConnections(
+            self.path,
+            "CREATE TABLE IF NOT EXISTS probes ("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, "
+            "duration REAL, format TEXT, used INTEGER)",
+        )
+
+    def get(self, path, stat):
+        """(duration, format) recorded for path, or None if missing or the file has changed"""
+        row = self.connections.get().execute(
+            "SELECT size, mtime, duration, format, used FROM probes WHERE path = ?",
+            (str(path),),
+        ).fetchone()
+        if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime_ns:
+            return None
+        now = int(time.time())
+        if now - row[4] > TOUCH_SECONDS:
+            self.connections.get().execute("UPDATE probes SET used = ? WHERE path = ?", (now, str(path)))
+        return row[2], row[3]
+
+    def put(self, path, stat, duration, format):
+        self.connections.get().execute(
+            "INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?, ?, ?)",
+            (str(path), stat.st_size, stat.st_mtime_ns, duration, format, int(time.time())),
+        )
+
+    def evict(self):
+        """Remove entries that have not been looked up in a long time
+
+        Entries for files that changed are replaced when the file is probed again.
+        """
+        expired = int(time.time()) - EXPIRY_SECONDS
+        self.connections.get().execute("DELETE FROM probes WHERE used < ?", (expired,))
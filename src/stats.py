@@ -0,0 +1,104 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+# counters kept for every step, added up per game, per step type and for the whole run
+COUNTERS = [
+    "bytes_read",
+    "bytes_written",
+    "files_probed",
+    "files_kept",
+    "files_dropped",
+    "files_deduplicated",
+    "bytes_deduplicated",
+    "tool_runs",
+    "tool_time",
+    "tool_cpu_time",
+]
+
+# the step being run in this process, which count() adds to from any thread
+active = None
+
+
+class StepStats():
+    """Wall time and counters of one run of one step"""
+    def __init__(self, step, index=None):
+        self.step = step
+        self.index = index
+        self.wall_time = 0.0
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.lock = threading.Lock()
+
+    def count(self, counter, amount=1):
+        with self.lock:
+            self.counters[counter] += amount
+
+    def to_dict(self):
+        """Plain data, which can be sent from worker processes and written as json"""
+        return {"step": self.step, "index": self.index, "wall_time": self.wall_time, **self.counters}
+
+
+def count(counter, amount=1):
+    """Add to a counter of the active step, if any"""
+    step_stats = active
+    if step_stats is not None:
+        step_stats.count(counter, amount)
+
+
+@contextlib.contextmanager
+def recording(step_stats):
+    """Make step_stats the active step, adding the time spent to its wall time"""
+    global active
+    previous = active
+    active = step_stats
+    start = time.perf_counter()
+    try:
+        yield step_stats
+    finally:
+        step_stats.wall_time += time.perf_counter() - start
+        active = previous
+
+
+def add_up(step_dicts):
+    totals = {"runs": 0, "wall_time": 0.0, **dict.fromkeys(COUNTERS, 0)}
+    for step_dict in step_dicts:
+        totals["runs"] += 1
+        totals["wall_time"] += step_dict["wall_time"]
+        for counter in COUNTERS:
+            totals[counter] += step_dict[counter]
+    return totals
+
+
+def report(results, started, wall_time, args):
+    """The run report, per game and per step type, from the stats of each GameResult"""
+    games = []
+    step_types = {}
+    for result in results:
+        steps = result.stats["steps"] if result.stats else []
+        games.append({
+            "game": result.game_name,
+            "extracted": result.extracted,
+            "error": result.error.splitlines()[-1] if result.error else None,
+            "wall_time": result.stats["wall_time"] if result.stats else 0.0,
+            "steps": steps,
+            "totals": add_up(steps),
+        })
+        for step_dict in steps:
+            step_types.setdefault(step_dict["step"], []).append(step_dict)
+    return {
+        "started": started.isoformat(timespec="seconds"),
+        "wall_time": wall_time,
+        "jobs": args.jobs,
+        "games": games,
+        "step_types": {step: add_up(step_dicts) for step, step_dicts in sorted(step_types.items())},
+        "totals": add_up([step_dict for game in games for step_dict in game["steps"]]),
+    }
+
+
+def write_report(path, report):
+    temp_path = str(path) + ".tmp"
+    with open(temp_path, "w") as report_file:
+        json.dump(report, report_file, indent=1)
+    os.replace(temp_path, path)
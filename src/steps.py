@@ -1,13 +1,35 @@
+import contextlib
 import fnmatch
+import functools
+import io
+import multiprocessing
 import os
+import re
 import shutil
 import subprocess
+import tempfile
+import threading
+import time
 
+import pathvalidate
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from typing import TypeVar
 from zipfile import ZipFile
 
+import dedup
+import devices
 import file_util
+import stats
+import vpk
+import xwb
+
+from sys import platform
+if platform.startswith("win"):
+    resource = None
+else:
+    import resource
 
 AnyType = TypeVar('AnyType')
 
@@ -32,54 +54,445 @@ def filespecify(filespecs: FilespecsType) -> FilespecsListType:
     return listify(filespecs)
 
 
+class FilespecMatcher():
+    """Include and exclude filespecs compiled once, matching like fnmatch.fnmatch"""
+    def __init__(self, filespecs: FilespecsType, excludespecs: FilespecsType = None):
+        self.include = self.compile(filespecify(filespecs))
+        self.exclude = self.compile(listify(excludespecs))
+
+    @staticmethod
+    def compile(specs: FilespecsListType):
+        """One regex matching any of specs, or None for no specs"""
+        if not specs:
+            return None
+        return re.compile(
+            "|".join(fnmatch.translate(os.path.normcase(spec)) for spec in specs)
+        ).match
+
+    def match(self, filename) -> bool:
+        """Check whether filename matches some filespec and no excludespec"""
+        filename = os.path.normcase(filename)
+        if self.exclude is not None and self.exclude(filename):
+            return False
+        return self.include is not None and self.include(filename) is not None
+
+    def filter(self, filenames: list[str]) -> list[str]:
+        """The filenames which match some filespec and no excludespec, in order"""
+        include = self.include
+        exclude = self.exclude
+        normcase = os.path.normcase
+        if include is None:
+            return []
+        if exclude is None:
+            return [filename for filename in filenames if include(normcase(filename))]
+        return [
+            filename for filename in filenames
+            if include(normcase(filename)) and not exclude(normcase(filename))
+        ]
+
+
+@functools.lru_cache()
+def filespec_matcher(filespecs: tuple[str, ...], excludespecs: tuple[str, ...]) -> FilespecMatcher:
+    return FilespecMatcher(list(filespecs), list(excludespecs))
+
+
 def apply_filespecs(filename: str, filespecs: FilespecsType,
                     excludespecs: FilespecsType = None) -> bool:
     """Check whether filename matches some filespec and no excludespec"""
-    filespecs = filespecify(filespecs)
-    excludespecs = listify(excludespecs)
-    for excludespec in excludespecs:
-        if fnmatch.fnmatch(filename, excludespec):
+    return filespec_matcher(
+        tuple(filespecify(filespecs)), tuple(listify(excludespecs))
+    ).match(filename)
+
+
+class ToolError(Exception):
+    pass
+
+
+class ToolRun(subprocess.CompletedProcess):
+    """A finished external tool invocation, with its wall clock and CPU time"""
+    def __init__(self, tool, args, returncode, stdout, stderr, wall_time, cpu_time):
+        super().__init__(args, returncode, stdout, stderr)
+        self.tool = tool
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+
+
+# Limits on simultaneous invocations of each tool, shared by every game being
+# extracted. The semaphores come from multiprocessing so that worker processes
+# extracting different games share them.
+LIMITED_TOOLS = [
+    "quickbms",
+    "BSAFileExtractor.py",
+    "FModBankParser.Demo",
+    "icoextract",
+    "ffmpeg",
+    "avconv",
+]
+tool_slots = {}
+
+
+def make_tool_slots(jobs):
+    return {tool: multiprocessing.BoundedSemaphore(jobs) for tool in LIMITED_TOOLS}
+
+
+# Limits on simultaneous copies and extractions from and to each drive, see devices.DeviceSlots
+device_slots = devices.DeviceSlots()
+
+
+def children_cpu_time():
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_tool(args, gameconfig, command, check = True, echo = 2, step_stats = None, **kwargs):
+    """Run an external tool with a timeout, recording its wall and CPU time in gameconfig.tool_runs
+
+    Output is printed when args.verbose is above echo, and a nonzero exit status raises ToolError if check is set.
+    Time is counted in step_stats if given, else in the active step.
+    """
+    count = stats.count if step_stats is None else step_stats.count
+    command = [str(part) for part in command]
+    tool = Path(command[0]).name
+    kwargs.setdefault("stdin", subprocess.DEVNULL)
+    with tool_slots.get(tool, contextlib.nullcontext()):
+        start = time.perf_counter()
+        # measured over all children of this process, so approximate if tools overlap
+        cpu_start = children_cpu_time()
+        try:
+            completed = subprocess.run(
+                command, capture_output=True, text=True,
+                errors="replace", timeout=args.tooltimeout, **kwargs
+            )
+        except subprocess.TimeoutExpired:
+            raise ToolError(f"{tool} timed out after {args.tooltimeout} s")
+        wall_time = time.perf_counter() - start
+        cpu_time = None if cpu_start is None else children_cpu_time() - cpu_start
+    tool_run = ToolRun(
+        tool, command, completed.returncode, completed.stdout, completed.stderr, wall_time, cpu_time
+    )
+    gameconfig.tool_runs.append(tool_run)
+    count("tool_runs")
+    count("tool_time", wall_time)
+    if cpu_time is not None:
+        count("tool_cpu_time", cpu_time)
+    if echo is not None and args.verbose > echo:
+        print(tool_run.stdout, end="")
+        print(tool_run.stderr, end="")
+    if args.verbose > 2:
+        cpu = "" if cpu_time is None else f", {cpu_time:.1f} s cpu"
+        print(f"  {tool}: {wall_time:.1f} s wall{cpu}")
+    if tool_run.returncode != 0:
+        message = f"{tool} exited with status {tool_run.returncode}"
+        if tool_run.stderr.strip():
+            message += ": " + tool_run.stderr.strip().splitlines()[-1]
+        if check:
+            raise ToolError(message)
+        if args.verbose > 0:
+            print("  " + message)
+    return tool_run
+
+
+def extract_member(dst, write, args, gameconfig, duration = None, tag = True):
+    """Write an archive member to dst through a staged file, if it is long enough
+
+    write is called with the open staged file. A duration known from the archive
+    is checked before anything is written, then the staged file is kept with
+    keep_staged(). Returns whether dst was written or linked.
+    """
+    if duration is not None and duration < args.minduration:
+        stats.count("files_dropped")
+        return False
+    if not args.overwrite and dst.exists():
+        return False
+    temp_file, temp_path = file_util.stage(dst)
+    try:
+        with temp_file:
+            write(temp_file)
+            stats.count("bytes_read", temp_file.tell())
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    return keep_staged(temp_path, dst, args, gameconfig, duration, tag)
+
+
+def keep_staged(temp_path, dst, args, gameconfig, duration = None, tag = True):
+    """Rename a complete staged file over dst if it is long enough, tagging it first
+
+    The staged file is probed unless its duration is known. Nothing replaces an
+    existing dst without args.overwrite, and gameconfig.content_store may link
+    dst to the same audio elsewhere instead. temp_path is gone afterwards.
+    Returns whether dst was written or linked.
+    """
+    try:
+        if duration is not None:
+            if tag:
+                file_util.tag(temp_path, gameconfig.gamename, args.albumsuffix)
+        elif tag:
+            if file_util.probe_and_tag(
+                temp_path, gameconfig.gamename, args.albumsuffix, args.minduration
+            ) < args.minduration:
+                temp_path.unlink()
+                stats.count("files_dropped")
+                return False
+        elif file_util.audio_duration(temp_path) < args.minduration:
+            temp_path.unlink()
+            stats.count("files_dropped")
+            return False
+        if not args.overwrite and dst.exists():
+            # another step, or an earlier run, wrote it
+            temp_path.unlink()
+            return False
+        store = gameconfig.content_store
+        holder = None if store is None else store.place(dedup.file_payload_hash(temp_path), dst, args.overwrite)
+        if holder is not None:
+            temp_path.unlink()
+            if store.mode == "link":
+                gameconfig.outputs.add(dst)
+                return True
+            gameconfig.outputs.add_duplicate(dst, holder)
             return False
-    for filespec in filespecs:
-        if fnmatch.fnmatch(filename, filespec):
-            return True
-    return False
+        os.replace(temp_path, dst)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    gameconfig.outputs.add(dst)
+    stats.count("files_kept")
+    stats.count("bytes_written", os.stat(dst).st_size)
+    return True
+
+
+# what a PlannedAction does:
+#   copy, extract: write destination from source, or from member of the source archive
+#   run: run a tool or python code on source, whose outputs are only known afterwards
+#   postprocess: rework the outputs of earlier steps, if any of them produced something
+#   unchanged: nothing, source is unchanged since the last run
+#   drop: nothing, the member is known to be shorter than --minduration
+#   unsupported: nothing, the member's audio format can't be written
+WRITING_ACTIONS = ["copy", "extract"]
+
+
+class PlannedAction():
+    """One file a step is going to write, or one run of a step whose outputs can't be known beforehand
+
+    size is the number of bytes to be written where the source tells, else the
+    size of the source. duration is the length in seconds where the source tells.
+    item is whatever the step needs to write the member, such as a bank entry.
+    offset is where the member lies in an archive, for reading them in order.
+    """
+    def __init__(self, step, action, source=None, member=None, destination=None, size=0, duration=None, item=None,
+                 offset=0):
+        self.step = step
+        self.action = action
+        self.source = source
+        self.member = member
+        self.destination = destination
+        self.size = size
+        self.duration = duration
+        self.item = item
+        self.offset = offset
+
+    def to_dict(self, gameconfig):
+        return {
+            "step": self.step.key,
+            "index": self.step.index,
+            "action": self.action,
+            "source": None if self.source is None else Path(self.source).relative_to(gameconfig.game_folder).as_posix(),
+            "member": self.member,
+            "destination": None if self.destination is None
+            else Path(self.destination).relative_to(gameconfig.output_game_path).as_posix(),
+            "size": self.size,
+            "tool": self.step.tool,
+        }
+
+
+def group_by_destination(actions):
+    """The copy and extract actions of a plan, grouped by destination in plan order
+
+    Sources with the same destination are tried one at a time, so the first long enough one is kept.
+    """
+    groups = {}
+    for action in actions:
+        if action.action in WRITING_ACTIONS:
+            groups.setdefault(action.destination, []).append(action)
+    return groups
+
+
+def extract_planned(actions, write, args, gameconfig, tag = True):
+    """Carry out the extract actions of an archive step's plan with extract_member
+
+    write is called with an action's item and the open staged file. Each member
+    holds a slot of device_slots on the archive's drive and the output drive.
+    """
+    for action in actions:
+        if action.action == "drop":
+            stats.count("files_dropped")
+        elif action.action == "unsupported" and args.verbose > 0:
+            print("  skipping " + action.member + ", its audio format is not supported")
+    groups = list(group_by_destination(actions).values())
+    output_device = devices.device_of(gameconfig.output_game_path)
+    sources = {action.source for group in groups for action in group}
+    source_devices = {source: devices.device_of(source) for source in sources}
+    threads = args.threads
+    rotational = [device for device in source_devices.values() if device_slots.is_rotational(device)]
+    if rotational:
+        # like copies in FilespecStep, a hard disk seeks least reading members in
+        # the order they lie in the archive, with no more threads than its slots
+        groups.sort(key=lambda group: group[0].offset)
+        threads = min([threads] + [device_slots.jobs_on(device, threads) for device in rotational])
+
+    def extract_group(group):
+        extracted = []
+        for action in group:
+            with device_slots.using(source_devices[action.source], output_device):
+                if extract_member(
+                    action.destination,
+                    functools.partial(write, action.item),
+                    args,
+                    gameconfig,
+                    duration=action.duration,
+                    tag=tag,
+                ):
+                    extracted.append(action)
+        return extracted
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        extracted_lists = executor.map(extract_group, groups)
+        for extracted in extracted_lists:
+            if args.verbose > 1:
+                for action in extracted:
+                    print("  " + action.member)
+
+
+def source_size(gameconfig, source):
+    try:
+        return gameconfig.game_index.stat(source).st_size
+    except OSError:
+        return 0
 
 
 class Step():
-    def __init__(self, step):
+    # steps which rework the output of earlier steps instead of reading the game folder
+    postprocess = False
+    # the external tool or module the step needs, if any
+    tool = None
+    # the extract step key naming this step type, set from StepFuncs
+    key = None
+    # steps which add the files they write to gameconfig.outputs themselves,
+    # the output path is walked before and after the others to find them
+    registers_outputs = False
+
+    def __init__(self, step, index=None):
         self.step = step
+        self.index = index
+        # the outputs planned by plan(), carried out by execute() instead of planning again
+        self.planned = None
+
+    def sources(self):
+        """Files in the game folder this step reads, relative to the game folder"""
+        return []
+
+    def plan(self, config, args, gameconfig, estimate = False):
+        """What run() would do, as a list of PlannedActions, without writing anything
+
+        With estimate, archives are not listed and a run over each source is planned
+        instead, which is enough to tell the size of the work from the folder index.
+        """
+        if self.postprocess:
+            return [PlannedAction(self, "postprocess")]
+        sources = [gameconfig.game_folder.joinpath(source) for source in self.sources()]
+        if sources and not args.overwrite and all(
+            gameconfig.manifest.is_current(self.index, source) for source in sources
+        ):
+            return [
+                PlannedAction(self, "unchanged", source, size=source_size(gameconfig, source))
+                for source in sources
+            ]
+        if estimate:
+            return Step.plan_outputs(self, config, args, gameconfig)
+        self.planned = self.plan_outputs(config, args, gameconfig)
+        return self.planned
+
+    def plan_outputs(self, config, args, gameconfig):
+        """What execute() would do, by default a single run over the sources"""
+        sources = [gameconfig.game_folder.joinpath(source) for source in self.sources()]
+        if not sources:
+            return [PlannedAction(self, "run")]
+        return [PlannedAction(self, "run", source, size=source_size(gameconfig, source)) for source in sources]
+
+    def planned_outputs(self, config, args, gameconfig):
+        """The outputs planned by plan(), or planned now if it was not called"""
+        if self.planned is None:
+            self.planned = self.plan_outputs(config, args, gameconfig)
+        return self.planned
+
+    def run(self, config, args, gameconfig):
+        """execute() unless the manifest shows the sources are unchanged since the last run"""
+        manifest = gameconfig.manifest
+        if self.postprocess:
+            if manifest.changed:
+                self.execute(config, args, gameconfig)
+            return
+        sources = [gameconfig.game_folder.joinpath(source) for source in self.sources()]
+        if sources and not args.overwrite and all(manifest.is_current(self.index, source) for source in sources):
+            return
+        mark = gameconfig.outputs.mark()
+        before = None if self.registers_outputs else manifest.snapshot()
+        executed = self.execute(config, args, gameconfig)
+        if before is not None:
+            gameconfig.outputs.add_all(manifest.new_outputs(before))
+        if not sources:
+            manifest.changed = True
+            return
+        if executed is False:
+            # nothing was attempted, e.g. a required tool is missing, so try again next run
+            return
+        outputs = gameconfig.outputs.added_since(mark)
+        duplicates = gameconfig.outputs.duplicates_since(mark)
+        for source in sources:
+            manifest.record(self.index, source, outputs, duplicates=duplicates)
 
-    def execute(self):
+    def execute(self, config, args, gameconfig):
         pass
 
 
 class FilespecStep(Step):
-    def execute(self, config, args, gameconfig):
+    registers_outputs = True
+
+    def run(self, config, args, gameconfig):
+        # the manifest is consulted for each matched file instead
+        self.execute(config, args, gameconfig)
+
+    def plan(self, config, args, gameconfig, estimate = False):
+        # globbing the folder index is cheap enough for an estimate
+        self.planned = self.plan_outputs(config, args, gameconfig)
+        return self.planned
+
+    def plan_outputs(self, config, args, gameconfig):
         if isinstance(self.step["filespec"], list):
+            filespecs = self.step["filespec"]
             if args.format == "*":
                 # we want all formats
                 # keep the whole filespec list
                 pass
             else:
-                self.step["filespec"] = [
+                filespecs = [
                     spec
-                    for spec in self.step["filespec"]
+                    for spec in filespecs
                     if Path(spec).suffix[1:].lower() == args.format.lower()
-                    and next(gameconfig.game_folder.glob(spec))
+                    and gameconfig.game_index.exists(spec)
                 ]
-            if len(self.step["filespec"]) == 0:
-                return False
             # FIXME improve spec to implement both of these needs:
             # filespec list might be [a/*.mp3,b/*.mp3] and we want the first that matches
             # filespec list might be [a/*.ogg,b/*.mp3] and we want the first that we can get
             # filespec list might be [a/*.ogg,b/*.mp3] and we want either or both depending on args.format
             # TODO support multiple args.format
-            filespecs = self.step["filespec"]
         else:
             filespecs = [self.step["filespec"]]
+        actions = []
         for filespec in filespecs:
-            for filepath in gameconfig.game_folder.glob(filespec):
+            for filepath in gameconfig.game_index.glob(filespec):
                 copydst = gameconfig.output_game_path
                 strip_glob_path = self.step.get("strip_glob_path", "")
                 if strip_glob_path != "":
@@ -87,14 +500,73 @@ class FilespecStep(Step):
                     copydst = gameconfig.output_game_path.joinpath(
                         filepath.parent.relative_to(strip_glob_full_path)
                     )
-                    copydst.mkdir(parents=True, exist_ok=True)
-                try:
-                    if file_util.audio_duration(filepath) >= args.minduration:
-                        if args.verbose > 1:
-                            print("  " + str(filepath.name))
-                        file_util.copy_and_tag(filepath, copydst, gameconfig.gamename, args.overwrite)
-                except FileExistsError:
-                    pass
+                stat = gameconfig.game_index.stat(filepath)
+                action = "copy"
+                if not args.overwrite and gameconfig.manifest.is_current(self.index, filepath, stat):
+                    action = "unchanged"
+                actions.append(PlannedAction(self, action, filepath, destination=copydst / filepath.name,
+                                             size=stat.st_size, item=stat))
+        return actions
+
+    def execute(self, config, args, gameconfig):
+        # files are grouped by destination, so that sources which would overwrite
+        # each other are still handled one at a time in glob order
+        copies = group_by_destination(self.planned_outputs(config, args, gameconfig))
+        for destination in copies:
+            gameconfig.outputs.mkdir(destination.parent)
+        groups = list(copies.values())
+        threads = args.threads
+        source_device = devices.device_of(gameconfig.game_folder)
+        if device_slots.is_rotational(source_device):
+            # item is the stat of the source, and a hard disk seeks least reading files
+            # in inode order, which mostly follows where they were written. More threads
+            # than the disk has slots would wait on them and wake up in any order.
+            groups.sort(key=lambda actions: actions[0].item.st_ino)
+            threads = min(threads, device_slots.jobs_on(source_device, threads))
+        output_device = devices.device_of(gameconfig.output_game_path)
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            copied_lists = executor.map(
+                lambda actions: self.copy_files(actions, config, args, gameconfig, output_device),
+                groups,
+            )
+            for copied in copied_lists:
+                if args.verbose > 1:
+                    for filepath in copied:
+                        print("  " + str(filepath.name))
+
+    def copy_files(self, actions, config, args, gameconfig, output_device = None):
+        """Copy the first long enough file of several with the same destination
+
+        Each copy holds a slot of device_slots on the source and output drives.
+        """
+        copied = []
+        for action in actions:
+            filepath = action.source
+            copydst = action.destination.parent
+            outputs = []
+            duplicates = {}
+            try:
+                # short files are skipped after the same mutagen open that reads their tags
+                with device_slots.using(action.item.st_dev, output_device):
+                    copied_file = file_util.copy_and_tag(
+                        filepath, copydst, gameconfig.gamename, args.overwrite, args.linkmode,
+                        args.albumsuffix, args.minduration, config.probe_cache, gameconfig.content_store,
+                    )
+                if copied_file is not None:
+                    copied.append(filepath)
+                    outputs.append(action.destination)
+            except FileExistsError:
+                # long enough, but an earlier run or another file already produced it
+                copied.append(filepath)
+                outputs.append(action.destination)
+            except dedup.Duplicate as duplicate:
+                # left out with --dedup skip, but recorded so an unchanged file is not copied again
+                duplicates[action.destination] = duplicate.holder
+                gameconfig.outputs.add_duplicate(action.destination, duplicate.holder)
+            gameconfig.outputs.add_all(outputs)
+            # item is the stat the plan was made from
+            gameconfig.manifest.record(self.index, filepath, outputs, action.item, duplicates)
+        return copied
 
 
 class PythonStep(Step):
@@ -111,166 +583,431 @@ class PythonStep(Step):
                         print("  " + file)
 
 
-class ZipfileStep(Step):
-    def execute(self, config, args, gameconfig):
-        with ZipFile(
-            Path(gameconfig.game_folder.joinpath(self.step["zipfile"])), "r"
-        ) as zipfile:
-            for filename in zipfile.namelist():
-                if apply_filespecs(filename, self.step["zipfilespec"], self.step.get("zipexcludespec", None)):
-                    if (
-                        args.overwrite
-                        or not gameconfig.output_game_path.joinpath(filename).exists()
-                    ):
-                        zipfile.extract(filename, path=gameconfig.output_game_path)
-                        file_util.tag(gameconfig.output_game_path / filename, gameconfig.gamename, args.albumsuffix)
-                        (gameconfig.output_game_path / filename).rename(
-                            gameconfig.output_game_path / Path(filename).name
-                        )
-                        if args.verbose > 1:
-                            print("  " + filename)
-        # TODO: eliminate unwanted levels of folder nesting here
+class ArchiveStep(Step):
+    """A step extracting the matching members of one archive in the game folder
+
+    Subclasses open the archive and list its members, the extraction is shared.
+    """
+    registers_outputs = True
+    # whether extracted members are tagged
+    tag = True
+
+    def open_archive(self, gameconfig):
+        raise NotImplementedError
 
+    def plan_members(self, archive, args, gameconfig):
+        raise NotImplementedError
+
+    def writer(self, archive):
+        """The function writing a planned action's item to a staged file"""
+        return archive.write
+
+    def plan_outputs(self, config, args, gameconfig):
+        with self.open_archive(gameconfig) as archive:
+            return self.plan_members(archive, args, gameconfig)
 
-# unxwb from https://github.com/mariodon/unxwb
-# TODO: support --overwrite
-class XwbfileStep(Step):
     def execute(self, config, args, gameconfig):
-        if args.overwrite:
-            prompt_key = "y"
-        else:
-            prompt_key = "n"
-        yes = subprocess.Popen(["yes", prompt_key], stdout=subprocess.PIPE)
-        # TODO capture output, suppress based on verbosity
-        command = [
-                "unxwb",
-                "-d",
-                gameconfig.output_game_path,
-            ]
+        with self.open_archive(gameconfig) as archive:
+            actions = self.planned
+            if actions is None:
+                actions = self.plan_members(archive, args, gameconfig)
+            extract_planned(actions, self.writer(archive), args, gameconfig, tag=self.tag)
+
+
+class ZipfileStep(ArchiveStep):
+    def sources(self):
+        return [self.step["zipfile"]]
+
+    def open_archive(self, gameconfig):
+        return ZipFile(Path(gameconfig.game_folder.joinpath(self.step["zipfile"])), "r")
+
+    def plan_members(self, zipfile, args, gameconfig):
+        matcher = FilespecMatcher(self.step["zipfilespec"], self.step.get("zipexcludespec", None))
+        infos = {info.filename: info for info in zipfile.infolist()}
+        source = gameconfig.game_folder.joinpath(self.step["zipfile"])
+        # members are extracted without their folders, so those with the same
+        # name end up in one group and are handled in archive order
+        return [
+            PlannedAction(self, "extract", source, filename, gameconfig.output_game_path / Path(filename).name,
+                          size=infos[filename].file_size, item=filename, offset=infos[filename].header_offset)
+            for filename in matcher.filter(list(infos))
+            if not filename.endswith("/")
+        ]
+
+    def writer(self, zipfile):
+        return functools.partial(self.write_member, zipfile)
+
+    def write_member(self, zipfile, filename, temp_file):
+        with zipfile.open(filename) as member:
+            shutil.copyfileobj(member, temp_file, 1024 * 1024)
+
+
+class VpkfileStep(ArchiveStep):
+    def sources(self):
+        return [self.step["vpkfile"]]
+
+    def open_archive(self, gameconfig):
+        return vpk.VpkArchive(gameconfig.game_folder.joinpath(self.step["vpkfile"]))
+
+    def plan_members(self, archive, args, gameconfig):
+        matcher = FilespecMatcher(self.step["vpkfilespec"], self.step.get("vpkexcludespec", None))
+        source = gameconfig.game_folder.joinpath(self.step["vpkfile"])
+        # entries are extracted without their folders, like zipfile members
+        actions = []
+        for path in matcher.filter(archive.namelist()):
+            entry = archive.entries[path]
+            # entries in the numbered chunk files are read chunk by chunk
+            actions.append(PlannedAction(
+                self, "extract", source, path, gameconfig.output_game_path / Path(path).name,
+                size=entry.size, item=path, offset=(entry.archive_index, entry.offset),
+            ))
+        return actions
+
+
+class XwbfileStep(ArchiveStep):
+    # mutagen can't tag RIFF files reliably
+    tag = False
+
+    def sources(self):
+        return [self.step["xwb_file"]] + listify(self.step.get("xsb_file", None))
+
+    def open_archive(self, gameconfig):
+        names = None
         if "xsb_file" in self.step:
-            command.extend( [
-                "-b",
-                gameconfig.game_folder.joinpath(self.step["xsb_file"]),
-                str(self.step.get("xsb_offset", 0)),
-            ])
-        command.append(gameconfig.game_folder.joinpath(self.step["xwb_file"]))
-        subprocess.run(
-            command,
-            stdin=yes.stdout,
-        )
-        yes.stdout.close()
+            names = xwb.read_xsb_names(
+                gameconfig.game_folder.joinpath(self.step["xsb_file"]), self.step.get("xsb_offset", 0)
+            )
+        return xwb.XwbArchive(gameconfig.game_folder.joinpath(self.step["xwb_file"]), names)
+
+    def plan_members(self, bank, args, gameconfig):
+        source = gameconfig.game_folder.joinpath(self.step["xwb_file"])
+        actions = []
+        # entries with the same name are handled one at a time in bank order
+        for entry in bank.entries:
+            if entry.extension is None:
+                # XMA audio
+                actions.append(PlannedAction(self, "unsupported", source, entry.name, size=entry.length, item=entry))
+                continue
+            action = "extract"
+            if entry.duration < args.minduration:
+                action = "drop"
+            # names come from the xsb file, and must not lead out of the output folder
+            filename = pathvalidate.sanitize_filename(entry.name + entry.extension, "_")
+            actions.append(PlannedAction(
+                self, action, source, entry.name + entry.extension,
+                gameconfig.output_game_path / filename,
+                size=len(entry.header()) + entry.length + entry.length % 2,
+                duration=entry.duration, item=entry, offset=entry.offset,
+            ))
+        return actions
+
+
+class MemoryBudget():
+    """Blocks acquire() until enough of a fixed number of bytes have been released
+
+    A single acquisition larger than the whole budget waits until nothing else is held.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.held = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, size):
+        size = min(size, self.size)
+        with self.condition:
+            self.condition.wait_for(lambda: self.held + size <= self.size)
+            self.held += size
+        return size
+
+    def release(self, size):
+        with self.condition:
+            self.held -= size
+            self.condition.notify_all()
 
 
 class AssetsfileStep(Step):
+    tool = "UnityPy"
+    registers_outputs = True
+
+    def sources(self):
+        return listify(self.step["assetsfile"])
+
     def execute(self, config, args, gameconfig):
         try:
+            import UnityPy
             from UnityPy.enums.ClassIDType import ClassIDType
-            from UnityPy.tools.extractor import extract_assets
         except:
-            return
-        # TODO support video assets for music videos and audio extraction
-        filespec = filespecify(self.step.get("assetsfilespec",None))
-        excludespec = listify(self.step.get("assetsexcludespec",None))
-
-        def asset_filter(obj):
-            if obj.type == ClassIDType.AudioClip:
-                if obj.m_Length and obj.m_Length < args.minduration:
-                    return False
-                if obj.name:
-                    return apply_filespecs(obj.name, filespec, excludespec)
-                return True
-            if obj.type == ClassIDType.Texture2D:
-                if obj.name:
-                    return apply_filespecs(obj.name, filespec, excludespec)
-                return True
             return False
+        # TODO support video assets for music videos and audio extraction
+        matcher = FilespecMatcher(self.step.get("assetsfilespec",None), self.step.get("assetsexcludespec",None))
+        # textures are only wanted as cover art, when the filespec names them
+        textures = "assetsfilespec" in self.step
+        budget = MemoryBudget(args.assetsmemory * 1024 * 1024)
         assetsfiles = self.step["assetsfile"]
         assetsfiles = listify(assetsfiles)
-        for assetsfile in assetsfiles:
-            path_id_list = extract_assets(
-                str(gameconfig.game_folder.joinpath(assetsfile)),
-                gameconfig.output_game_path,
-                use_container = False,
-                append_path_id = False,
-                asset_filter = asset_filter,
-            )
-            if len(path_id_list) == 0:
-                raise Exception("Empty unity extract")
-        # TODO collect and output filenames for verbose>1
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            for assetsfile in assetsfiles:
+                env = UnityPy.load(str(gameconfig.game_folder.joinpath(assetsfile)))
+                futures = []
+                written = 0
+                # clips with the same name are written to the same file, so they are
+                # written one at a time by one thread, and the first long enough one is kept
+                clip_groups = {}
+                for obj in env.objects:
+                    if obj.type == ClassIDType.AudioClip:
+                        pass
+                    elif obj.type == ClassIDType.Texture2D and textures:
+                        pass
+                    else:
+                        continue
+                    # only the name is read here, AudioClips load their audio data when they are read
+                    name = self.peek_name(obj)
+                    if name and not matcher.match(name):
+                        continue
+                    if obj.type == ClassIDType.Texture2D:
+                        # decoded here, image data may be read lazily from the assets file
+                        for filename in self.write_texture(obj.read(), args, gameconfig):
+                            written += 1
+                            if args.verbose > 1:
+                                print("  " + filename)
+                        continue
+                    clip_groups.setdefault(name, []).append(obj)
+                for objs in clip_groups.values():
+                    clips = []
+                    size = 0
+                    for obj in objs:
+                        # read here, as the objects of an assets file share one reader
+                        clip = obj.read()
+                        if getattr(clip, "m_Length", None) and clip.m_Length < args.minduration:
+                            stats.count("files_dropped")
+                            continue
+                        stats.count("bytes_read", len(getattr(clip, "m_AudioData", None) or b""))
+                        # the encoded data is in memory now, decoding adds the samples
+                        size += len(getattr(clip, "m_AudioData", None) or b"") + int(
+                            getattr(clip, "m_Length", 0) * getattr(clip, "m_Frequency", 0)
+                            * getattr(clip, "m_Channels", 0) * 2
+                        )
+                        clips.append(clip)
+                    if not clips:
+                        continue
+                    held = budget.acquire(size)
+                    futures.append(executor.submit(self.write_clips, clips, args, gameconfig, budget, held))
+                if len(futures) == 0 and written == 0:
+                    raise Exception("Empty unity extract: " + assetsfile)
+                for future in as_completed(futures):
+                    for filename in future.result():
+                        if args.verbose > 1:
+                            print("  " + filename)
+                del env
+
+    @staticmethod
+    def peek_name(obj):
+        """The name of an AudioClip or Texture2D without reading the rest of the object"""
+        # ObjectReader.__getattr__ answers None for what it lacks, so hasattr is no test
+        if callable(getattr(obj, "peek_name", None)):
+            return obj.peek_name()
+        # NamedObjects start with their name, as UnityPy.classes.NamedObject reads it
+        obj.reset()
+        name = obj.reader.read_aligned_string()
+        obj.reset()
+        return name
+
+    def write_clips(self, clips, args, gameconfig, budget, held):
+        """Decode AudioClips in order and write their sounds, returning their file names"""
+        try:
+            written = []
+            for clip in clips:
+                for filename, data in clip.samples.items():
+                    filename = pathvalidate.sanitize_filename(filename, "_")
+                    if self.write_output(gameconfig.output_game_path / filename, data, args, gameconfig):
+                        written.append(filename)
+            return written
+        finally:
+            budget.release(held)
+
+    def write_texture(self, texture, args, gameconfig):
+        if not texture.m_Width:
+            # textures can be empty
+            return []
+        filename = pathvalidate.sanitize_filename((texture.m_Name or "Texture2D") + ".png", "_")
+        image = io.BytesIO()
+        texture.image.save(image, "png")
+        if self.write_output(gameconfig.output_game_path / filename, image.getbuffer(), args, gameconfig):
+            return [filename]
+        return []
+
+    @staticmethod
+    def write_output(dst, data, args, gameconfig):
+        if not args.overwrite and dst.exists():
+            return False
+        store = gameconfig.content_store
+        holder = None if store is None else store.place(dedup.payload_hash(data), dst, args.overwrite)
+        if holder is not None:
+            if store.mode == "link":
+                gameconfig.outputs.add(dst)
+                return True
+            gameconfig.outputs.add_duplicate(dst, holder)
+            return False
+        temp_file, temp_path = file_util.stage(dst)
+        try:
+            with temp_file:
+                temp_file.write(data)
+            os.replace(temp_path, dst)
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+        gameconfig.outputs.add(dst)
+        stats.count("files_kept")
+        stats.count("bytes_written", len(data))
+        return True
+
+
+# a line of quickbms -l output: offset in hex, size and name
+QUICKBMS_LISTING = re.compile(r"^\s*([0-9a-fA-F]+)\s+(\d+)\s+(.*\S)\s*$")
+# audio entries smaller than --minduration at this many bytes per second are
+# not extracted at all, as no game music is stored below 6 kbit/s, the lowest Opus bitrate
+MIN_AUDIO_BYTES_PER_SECOND = 750
+AUDIO_EXTENSIONS = [".ogg", ".opus", ".mp3", ".wav", ".flac", ".m4a", ".wma"]
 
 
 class QuickBmsStep(Step):
+    tool = "quickbms"
+    registers_outputs = True
+
+    def sources(self):
+        return [self.step["quickbmsarchive"]]
+
+    def command(self, options, gameconfig):
+        script_dir = Path(__file__).resolve().parent
+        return ["quickbms"] + options + [
+            script_dir / "scripts" / self.step["quickbmsscript"],
+            gameconfig.game_folder.joinpath(self.step["quickbmsarchive"]),
+        ]
+
+    def matcher(self):
+        return FilespecMatcher(self.step.get("quickbmsfilespec", None))
+
+    def plan_outputs(self, config, args, gameconfig):
+        """The archive's files matching quickbmsfilespec, from its listing, dropping audio too small to last"""
+        if shutil.which("quickbms") is None:
+            return super().plan_outputs(config, args, gameconfig)
+        listing = run_tool(args, gameconfig, self.command(["-l"], gameconfig), echo=None)
+        matcher = self.matcher()
+        source = gameconfig.game_folder.joinpath(self.step["quickbmsarchive"])
+        actions = []
+        for line in listing.stdout.splitlines():
+            match = QUICKBMS_LISTING.match(line)
+            if match is None:
+                continue
+            name = match.group(3).replace("\\", "/")
+            size = int(match.group(2))
+            if not matcher.match(name):
+                continue
+            action = "extract"
+            if (Path(name).suffix.lower() in AUDIO_EXTENSIONS
+                    and size < args.minduration * MIN_AUDIO_BYTES_PER_SECOND):
+                action = "drop"
+            actions.append(PlannedAction(self, action, source, name, gameconfig.output_game_path / name, size=size))
+        return actions
+
     def execute(self, config, args, gameconfig):
-        verbose = None
+        if shutil.which("quickbms") is None:
+            return False
+        # the listing made when planning, if the game was planned in this process
+        actions = self.planned_outputs(config, args, gameconfig)
+        stats.count("files_dropped", sum(1 for action in actions if action.action == "drop"))
+        names = [action.member for action in actions if action.action == "extract"]
+        if not names:
+            return
+        verbose = []
         if args.verbose == 0:
-            verbose = "-Q"
+            verbose = ["-Q"]
         elif args.verbose == 1:
-            verbose = "-q"
+            verbose = ["-q"]
         elif args.verbose == 3:
-            verbose = "-V"
+            verbose = ["-V"]
         elif args.verbose == 4:
-            verbose = "-v"
-        if args.overwrite:
-            overwrite = "-o"
-        else:
-            overwrite = "-k"
-        # TODO capture output, suppress based on verbosity
-        command = [
-                "quickbms",
-                overwrite,
-            ]
-        if verbose:
-            command.append(verbose)
-        if "quickbmsfilespec" in self.step:
-            filespecs = filespecify(self.step["quickbmsfilespec"])
-            command.extend( [
-                "-f",
-                ";".join(filespecs)
-            ])
-        script_dir = Path(__file__).resolve().parent
-        command.append(script_dir / "scripts" / self.step["quickbmsscript"])
-        command.append(gameconfig.game_folder.joinpath(self.step["quickbmsarchive"]))
-        command.append(gameconfig.output_game_path)
-        # TODO consolidate use of subprocess (here, unxwb, etc) for consistent handling of output
-        subprocess.run(command, capture_output = args.verbose == 0)
-        # TODO apply args.minduration more precisely than this FilterFilespecStep which could delete previous steps' files
-        if "quickbmsfilespec" in self.step:
-            FilterFilespecStep({"filterfilespec" : filespecs}).execute(config, args, gameconfig)
+            verbose = ["-v"]
+        # only the files wanted are extracted, into a folder of their own, so
+        # --minduration applies to them and not to the output of earlier steps
+        staging_path = Path(tempfile.mkdtemp(prefix=".vgmx-quickbms-", dir=gameconfig.output_game_path))
+        try:
+            filter_path = staging_path / "filter.txt"
+            filter_path.write_text("".join(name + "\n" for name in names))
+            files_path = staging_path / "files"
+            files_path.mkdir()
+            # the staging folder is empty, so there is nothing to keep or prompt about
+            command = self.command(["-o"] + verbose + ["-f", filter_path], gameconfig) + [files_path]
+            # quickbms already limits its output to the verbosity asked for
+            run_tool(args, gameconfig, command, echo=0)
+            matcher = self.matcher()
+            for temp_path in sorted(files_path.rglob("*")):
+                relative = temp_path.relative_to(files_path)
+                if not temp_path.is_file() or not matcher.match(relative.as_posix()):
+                    continue
+                dst = gameconfig.output_game_path / relative
+                gameconfig.outputs.mkdir(dst.parent)
+                stats.count("bytes_read", temp_path.stat().st_size)
+                if keep_staged(temp_path, dst, args, gameconfig) and args.verbose > 1:
+                    print("  " + relative.as_posix())
+        finally:
+            shutil.rmtree(staging_path, ignore_errors=True)
 
 
 class FilterFilespecStep(Step):
+    postprocess = True
+
     def execute(self, config, args, gameconfig):
         filespecs = filespecify(self.step["filterfilespec"])
+        matcher = FilespecMatcher(self.step.get("filterincludespec","*"), self.step.get("filterexcludespec",None))
         for filespec in filespecs:
-            for file in gameconfig.output_game_path.glob(filespec):
-                if not apply_filespecs(file, self.step.get("filterincludespec","*"), self.step.get("filterexcludespec",None)) or file_util.audio_duration(file) < args.minduration:
+            for file in list(gameconfig.outputs.glob(filespec)):
+                if not matcher.match(file):
                     os.unlink(file)
+                    gameconfig.outputs.remove(file)
+                elif file_util.audio_duration(file, config.probe_cache) < args.minduration:
+                    os.unlink(file)
+                    gameconfig.outputs.remove(file)
+                    stats.count("files_dropped")
 
 
 class FlattenFilespecStep(Step):
+    postprocess = True
+
     def execute(self, config, args, gameconfig):
         dirs = []
-        for file in gameconfig.output_game_path.glob(self.step["flattenfilespec"]):
+        for file in list(gameconfig.outputs.glob(self.step["flattenfilespec"])):
             if file.is_file():
                 # TODO allow partial flattening
                 print(file, gameconfig.output_game_path / file.name)
                 os.rename(file, gameconfig.output_game_path / file.name)
+                gameconfig.manifest.rename_output(file, gameconfig.output_game_path / file.name)
+                gameconfig.outputs.rename(file, gameconfig.output_game_path / file.name)
             elif file.is_dir():
                 dirs.append(file)
             else:
                 # TODO handle sockets, block devices, etc?
                 pass
-        for dir in reversed(dirs):
+        # deepest first, as removedirs also removes parents left empty
+        for dir in sorted(dirs, key=lambda dir: len(dir.parts), reverse=True):
             try:
                 os.removedirs(dir)
             except FileNotFoundError:
                 pass
+            gameconfig.outputs.remove(dir)
 
 
 class IcoextractStep(Step):
+    tool = "icoextract"
+
+    def sources(self):
+        if isinstance(self.step["icoextract"], dict):
+            return [self.step["icoextract"]["filename"]]
+        return [self.step["icoextract"]]
+
     def execute(self, config, args, gameconfig):
         if shutil.which("icoextract") is None:
-            return
+            return False
         index = 0
         if isinstance(self.step["icoextract"], str):
             exe_file = self.step["icoextract"]
@@ -281,21 +1018,28 @@ class IcoextractStep(Step):
             raise ValueError
         ico_file = Path(exe_file).with_suffix(".ico")
         command = [ "icoextract", "-n", str(index), gameconfig.game_folder.joinpath(exe_file), gameconfig.output_game_path.joinpath(ico_file) ]
-        subprocess.run(command)
-        if args.verbose > 1:
+        # a missing icon is not worth failing the game over
+        if run_tool(args, gameconfig, command, check=False).returncode == 0 and args.verbose > 1:
             print("  " + str(ico_file))
 
 
 class TagFilespecStep(Step):
+    postprocess = True
+
     def execute(self, config, args, gameconfig):
-        for filepath in gameconfig.output_game_path.glob(self.step["tag_filespec"]):
+        for filepath in gameconfig.outputs.glob(self.step["tag_filespec"]):
             file_util.tag(filepath, gameconfig.gamename, args.albumsuffix)
 
 
 class BsafileStep(Step):
+    tool = "BSAFileExtractor.py"
+
+    def sources(self):
+        return [self.step["bsafile"]]
+
     def execute(self, config, args, gameconfig):
         if shutil.which("BSAFileExtractor.py") is None:
-            return
+            return False
         #FIXME BSAFileExtractor doesn't support wildcards
         # https://github.com/Sw4T/BSAFileExtractor/issues/1
         files = filespecify(self.step.get("bsafilespec",None))
@@ -307,13 +1051,18 @@ class BsafileStep(Step):
                 gameconfig.output_game_path
             ]
         command = command + files
-        subprocess.run(command)
+        run_tool(args, gameconfig, command)
 
 
 class BankfileStep(Step):
+    tool = "FModBankParser.Demo"
+
+    def sources(self):
+        return [self.step["bankfile"]]
+
     def execute(self, config, args, gameconfig):
         if shutil.which("FModBankParser.Demo") is None:
-            return
+            return False
 
         command = [
                 "FModBankParser.Demo",
@@ -321,10 +1070,10 @@ class BankfileStep(Step):
                 "-o", gameconfig.output_game_path,
                 str(gameconfig.game_folder.joinpath(self.step["bankfile"])),
             ]
-        subprocess.run(command, stdin=subprocess.DEVNULL)
         # stdin redirect is necessary to avoid "press any key" prompt
-        # FModBankParser.Demo will throw an exception
+        # FModBankParser.Demo will throw an exception, so its exit status means nothing
         # Fix for this is blocked by https://github.com/dotnet/runtime/issues/66530
+        run_tool(args, gameconfig, command, check=False, stdin=subprocess.DEVNULL)
 
 
 StepFuncs = {
@@ -332,6 +1081,7 @@ StepFuncs = {
     "python": PythonStep,
     "tag_filespec": TagFilespecStep,
     "zipfile": ZipfileStep,
+    "vpkfile": VpkfileStep,
     "xwb_file": XwbfileStep,
     "assetsfile": AssetsfileStep,
     "quickbmsscript": QuickBmsStep,
@@ -341,3 +1091,5 @@ StepFuncs = {
     "bsafile": BsafileStep,
     "bankfile": BankfileStep,
 }
+for key, step_class in StepFuncs.items():
+    step_class.key = key
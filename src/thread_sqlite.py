@@ -0,0 +1,26 @@
+import sqlite3
+import threading
+
+from pathlib import Path
+
+
+class ThreadConnections():
+    """A sqlite connection to one database for each thread, created on first use
+
+    Connections run in autocommit and WAL mode, so worker processes share the
+    database through sqlite's own locking, and create schema if it is missing.
+    """
+    def __init__(self, path, schema):
+        self.path = Path(path)
+        self.schema = schema
+        self.local = threading.local()
+
+    def get(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(self.schema)
+            self.local.connection = connection
+        return connection
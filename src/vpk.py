@@ -0,0 +1,128 @@
+import mmap
+import struct
+import threading
+
+from pathlib import Path
+
+# Valve pak archives, version 1 and 2, as used by Source engine games
+# https://developer.valvesoftware.com/wiki/VPK_(file_format)
+
+SIGNATURE = 0x55AA1234
+HEADER_V1 = struct.Struct("<III")
+HEADER_V2 = struct.Struct("<IIIIIII")
+ENTRY = struct.Struct("<IHHIIH")
+ENTRY_TERMINATOR = 0xFFFF
+# archive index of entries stored in the directory file itself, after the tree
+DIRECTORY_ARCHIVE = 0x7FFF
+
+
+class VpkEntry():
+    def __init__(self, path, crc, preload, archive_index, offset, length):
+        self.path = path
+        self.crc = crc
+        self.preload = preload
+        self.archive_index = archive_index
+        self.offset = offset
+        self.length = length
+
+    @property
+    def size(self):
+        return len(self.preload) + self.length
+
+
+class VpkArchive():
+    """A VPK directory file and its numbered chunk files, which are memory mapped as they are needed
+
+    Use as a context manager so the mappings are closed afterwards.
+    """
+    def __init__(self, dir_path):
+        self.dir_path = Path(dir_path)
+        if not self.dir_path.stem.endswith("_dir"):
+            raise ValueError("not a VPK directory file: " + str(self.dir_path))
+        self.chunk_prefix = self.dir_path.stem[:-len("_dir")]
+        self.maps = {}
+        self.maps_lock = threading.Lock()
+        self.entries = {}
+        try:
+            directory = self.map(DIRECTORY_ARCHIVE)
+            signature, version, tree_size = HEADER_V1.unpack_from(directory)
+            if signature != SIGNATURE:
+                raise ValueError("not a VPK file: " + str(self.dir_path))
+            if version == 1:
+                header_size = HEADER_V1.size
+            elif version == 2:
+                header_size = HEADER_V2.size
+            else:
+                raise ValueError("unsupported VPK version " + str(version) + ": " + str(self.dir_path))
+            self.data_offset = header_size + tree_size
+            self.read_tree(directory, header_size, self.data_offset)
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for archive_map in self.maps.values():
+            archive_map.close()
+        self.maps = {}
+
+    def chunk_path(self, archive_index):
+        if archive_index == DIRECTORY_ARCHIVE:
+            return self.dir_path
+        return self.dir_path.with_name(f"{self.chunk_prefix}_{archive_index:03}{self.dir_path.suffix}")
+
+    def map(self, archive_index):
+        with self.maps_lock:
+            if archive_index not in self.maps:
+                with open(self.chunk_path(archive_index), "rb") as chunk_file:
+                    self.maps[archive_index] = mmap.mmap(chunk_file.fileno(), 0, access=mmap.ACCESS_READ)
+            return self.maps[archive_index]
+
+    def read_tree(self, directory, position, end):
+        def read_string():
+            nonlocal position
+            terminator = directory.find(b"\0", position, end)
+            if terminator < 0:
+                raise ValueError("truncated VPK directory tree: " + str(self.dir_path))
+            string = directory[position:terminator].decode("utf-8", "surrogateescape")
+            position = terminator + 1
+            return string
+
+        # the tree is grouped by extension, then by folder, a single space standing for none
+        while extension := read_string():
+            while folder := read_string():
+                while name := read_string():
+                    crc, preload_size, archive_index, offset, length, terminator = ENTRY.unpack_from(
+                        directory, position
+                    )
+                    if terminator != ENTRY_TERMINATOR:
+                        raise ValueError("corrupt VPK directory entry: " + str(self.dir_path))
+                    position += ENTRY.size
+                    preload = directory[position:position + preload_size]
+                    position += preload_size
+                    path = name
+                    if extension != " ":
+                        path += "." + extension
+                    if folder != " ":
+                        path = folder + "/" + path
+                    self.entries[path] = VpkEntry(path, crc, preload, archive_index, offset, length)
+
+    def namelist(self):
+        return list(self.entries)
+
+    def write(self, path, file):
+        """Write the contents of an entry to a binary file, straight from the mapped chunk"""
+        entry = self.entries[path]
+        if entry.preload:
+            file.write(entry.preload)
+        if entry.length:
+            offset = entry.offset
+            if entry.archive_index == DIRECTORY_ARCHIVE:
+                offset += self.data_offset
+            with memoryview(self.map(entry.archive_index))[offset:offset + entry.length] as view:
+                file.write(view)
@@ -0,0 +1,283 @@
+import argparse
+import collections
+import concurrent.futures
+import datetime
+import fnmatch
+import json
+import os
+import select
+import struct
+import time
+
+from pathlib import Path
+
+import config
+import devices
+import extraction
+import steps
+
+from sys import platform
+if platform.startswith("linux"):
+    import ctypes
+    import ctypes.util
+else:
+    ctypes = None
+
+STATUS_NAME = ".vgmx-watch.json"
+APPMANIFEST_PATTERN = "appmanifest_*.acf"
+# finished games listed in the status file
+RECENT_RESULTS = 50
+
+# inotify(7)
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def now():
+    return datetime.datetime.now().astimezone().isoformat(timespec="seconds")
+
+
+class PollingWatcher():
+    """Finds changed appmanifests by listing each steamapps folder every interval seconds"""
+    name = "polling"
+
+    def __init__(self, steamapps_paths, interval):
+        self.steamapps_paths = steamapps_paths
+        self.interval = interval
+        self.next_poll = time.monotonic() + interval
+        self.files = self.scan()
+
+    def scan(self):
+        files = {}
+        for steamapps_path in self.steamapps_paths:
+            try:
+                with os.scandir(steamapps_path) as entries:
+                    for entry in entries:
+                        if fnmatch.fnmatch(entry.name, APPMANIFEST_PATTERN):
+                            stat = entry.stat()
+                            files[Path(entry.path)] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                # a library on a drive that is not mounted right now
+                continue
+        return files
+
+    def changes(self, timeout):
+        """Appmanifests added, changed or removed, waiting up to timeout seconds for any"""
+        wait = self.next_poll - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return set()
+        time.sleep(max(wait, 0))
+        self.next_poll = time.monotonic() + self.interval
+        files = self.scan()
+        changed = {path for path in files.keys() | self.files.keys() if files.get(path) != self.files.get(path)}
+        self.files = files
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher():
+    """Finds changed appmanifests through inotify watches on each steamapps folder, on Linux"""
+    name = "inotify"
+
+    def __init__(self, steamapps_paths):
+        if ctypes is None:
+            raise OSError("inotify is only available on Linux")
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.steamapps_paths = {}
+        try:
+            for steamapps_path in steamapps_paths:
+                watch = self.libc.inotify_add_watch(
+                    self.fd, os.fsencode(steamapps_path),
+                    IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE,
+                )
+                if watch < 0:
+                    raise OSError(ctypes.get_errno(), "inotify_add_watch failed: " + str(steamapps_path))
+                self.steamapps_paths[watch] = steamapps_path
+        except BaseException:
+            os.close(self.fd)
+            raise
+
+    def changes(self, timeout):
+        """Appmanifests added, changed or removed, waiting up to timeout seconds for any"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            position = 0
+            while position < len(data):
+                watch, mask, _, length = INOTIFY_EVENT.unpack_from(data, position)
+                name = data[position + INOTIFY_EVENT.size:position + INOTIFY_EVENT.size + length].rstrip(b"\0")
+                position += INOTIFY_EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    # events were lost, so every appmanifest may have changed
+                    for steamapps_path in self.steamapps_paths.values():
+                        changed.update(steamapps_path.glob(APPMANIFEST_PATTERN))
+                    continue
+                name = os.fsdecode(name)
+                if watch in self.steamapps_paths and fnmatch.fnmatch(name, APPMANIFEST_PATTERN):
+                    changed.add(self.steamapps_paths[watch] / name)
+
+    def close(self):
+        os.close(self.fd)
+
+
+def make_watcher(steamapps_paths, interval):
+    try:
+        return InotifyWatcher(steamapps_paths)
+    except OSError:
+        return PollingWatcher(steamapps_paths, interval)
+
+
+class Watch():
+    """Extracts games whenever Steam installs or updates them, until interrupted
+
+    Changed appmanifests settle for --watchdebounce seconds after their last
+    change and until Steam marks the app fully installed. The games installed
+    in the app's folder are then queued, each at most once, and extracted by
+    --jobs worker processes. What is settling, pending, running and recently
+    finished is kept in a json status file.
+    """
+    def __init__(self, configuration, args):
+        self.configuration = configuration
+        self.args = args
+        self.status_path = Path(args.watchstatus or configuration.output_path / STATUS_NAME)
+        self.steamapps_paths = [path / "steamapps" for path in configuration.steam_library_paths]
+        self.watcher = make_watcher(self.steamapps_paths, args.watchinterval)
+        # appmanifest path -> monotonic time it is read again
+        self.settling = {}
+        # game name -> time it was queued, in queue order
+        self.pending = {}
+        # future -> (game name, time it started)
+        self.running = {}
+        self.finished = collections.deque(maxlen=RECENT_RESULTS)
+
+    def queue(self, game_name):
+        self.pending.setdefault(game_name, now())
+
+    def settle(self):
+        """Queue the games of appmanifests which have been quiet long enough and are installed"""
+        for appmanifest_path, deadline in list(self.settling.items()):
+            if deadline > time.monotonic():
+                continue
+            del self.settling[appmanifest_path]
+            try:
+                app = config.read_appmanifest(appmanifest_path.parent.parent, appmanifest_path)
+            except (OSError, SyntaxError, KeyError, StopIteration, ValueError):
+                # removed, so uninstalled, or still half written
+                if appmanifest_path.exists():
+                    self.settling[appmanifest_path] = time.monotonic() + self.args.watchdebounce
+                continue
+            if not app.is_ready:
+                # Steam writes the appmanifest again when it is done
+                continue
+            game_names = self.configuration.games_installed_in(app.installdir)
+            if self.args.verbose > 0 and game_names:
+                print(f"{app.name or app.installdir} changed, queueing " + ", ".join(game_names))
+            for game_name in game_names:
+                self.queue(game_name)
+
+    def collect(self):
+        for future in [future for future in self.running if future.done()]:
+            game_name, started = self.running.pop(future)
+            result = future.result()
+            print(result.output, end="")
+            if result.error:
+                print(game_name + ": " + result.error.splitlines()[-1])
+            self.finished.appendleft({
+                "game": game_name,
+                "started": started,
+                "finished": now(),
+                "extracted": result.extracted,
+                "error": result.error.splitlines()[-1] if result.error else None,
+            })
+
+    def write_status(self):
+        status = {
+            "updated": now(),
+            "watcher": self.watcher.name,
+            "libraries": [str(path) for path in self.steamapps_paths],
+            "settling": [
+                {"appmanifest": str(path), "seconds_left": max(0, round(deadline - time.monotonic()))}
+                for path, deadline in self.settling.items()
+            ],
+            "pending": [{"game": game_name, "queued": queued} for game_name, queued in self.pending.items()],
+            "running": [{"game": game_name, "started": started} for game_name, started in self.running.values()],
+            "finished": list(self.finished),
+        }
+        temp_path = self.status_path.with_name(self.status_path.name + ".tmp")
+        with open(temp_path, "w") as status_file:
+            json.dump(status, status_file, indent=1)
+        os.replace(temp_path, self.status_path)
+
+    def run(self):
+        jobs = max(1, self.args.jobs)
+        # games already extracted are revisited, the manifest skips those Steam did not update
+        self.args.rescan = True
+        worker_args = argparse.Namespace(**vars(self.args))
+        del worker_args.parser
+        if self.args.verbose > 0:
+            print(f"watching {len(self.steamapps_paths)} libraries with {self.watcher.name}")
+        # games may have been installed or updated while nothing was watching
+        for game_name in self.configuration.games:
+            self.queue(game_name)
+        # whether games were extracted since the probe cache was last evicted
+        extracted = False
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=extraction.init_worker,
+            initargs=(
+                worker_args,
+                steps.make_tool_slots(self.args.tooljobs),
+                devices.make_device_slots(self.configuration, self.args),
+            ),
+        )
+        try:
+            while True:
+                while self.pending and len(self.running) < jobs:
+                    game_name = next(iter(self.pending))
+                    del self.pending[game_name]
+                    # workers read the appmanifests again, for the build Steam just installed
+                    future = executor.submit(extraction.extract_game_in_worker, game_name, True)
+                    self.running[future] = (game_name, now())
+                    extracted = True
+                if extracted and not self.pending and not self.running:
+                    # a batch of games is done, as a run without --watch ends here
+                    self.configuration.probe_cache.evict()
+                    extracted = False
+                self.write_status()
+                timeout = self.args.watchinterval
+                if self.settling:
+                    timeout = min(timeout, max(0, min(self.settling.values()) - time.monotonic()))
+                if self.running:
+                    # a game finishing frees a worker, library changes can wait until then
+                    concurrent.futures.wait(self.running, timeout, concurrent.futures.FIRST_COMPLETED)
+                    timeout = 0
+                for appmanifest_path in self.watcher.changes(timeout):
+                    # Steam rewrites an appmanifest many times while it installs
+                    self.settling[appmanifest_path] = time.monotonic() + self.args.watchdebounce
+                self.collect()
+                self.settle()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            executor.shutdown(cancel_futures=True)
+            self.watcher.close()
+            self.write_status()
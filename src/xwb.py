@@ -0,0 +1,241 @@
+import mmap
+import struct
+
+from pathlib import Path
+
+# XACT3 wave banks, as used by XNA games
+# https://github.com/microsoft/DirectXTK/blob/main/Audio/WaveBankReader.cpp
+
+SIGNATURE = b"WBND"
+# the header version field and the fifth segment were added in version 42
+MIN_VERSION = 42
+HEADER = struct.Struct("<4sII")
+SEGMENT = struct.Struct("<II")
+SEGMENT_COUNT = 5
+BANK_DATA, ENTRY_METADATA, SEEK_TABLES, ENTRY_NAMES, ENTRY_WAVE_DATA = range(SEGMENT_COUNT)
+BANK = struct.Struct("<II64sIIII")
+ENTRY = struct.Struct("<IIII")
+
+FLAGS_ENTRYNAMES = 0x00010000
+FLAGS_COMPACT = 0x00020000
+
+TAG_PCM, TAG_XMA, TAG_ADPCM, TAG_WMA = range(4)
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_ADPCM = 0x0002
+WAVE_FORMAT_WMAUDIO2 = 0x0161
+WAVE_FORMAT_WMAUDIO3 = 0x0162
+
+ADPCM_BLOCKALIGN_CONVERSION_OFFSET = 22
+ADPCM_COEFFICIENTS = ((256, 0), (512, -256), (0, 0), (192, 64), (240, 0), (460, -208), (392, -232))
+WMA_AVG_BYTES_PER_SEC = (12000, 24000, 4000, 6000, 8000, 20000, 2500)
+WMA_BLOCK_ALIGN = (929, 1487, 1280, 2230, 8917, 8192, 4459, 5945, 2304, 1536, 1485, 1008, 2731, 4096, 6827, 5462, 1280)
+
+
+def read_xsb_names(path, offset):
+    """The null terminated sound names starting at offset in an XACT sound bank
+
+    Whatever follows the names is split up too, a wave bank uses as many as it has entries.
+    """
+    data = Path(path).read_bytes()
+    return [name.decode("latin-1") for name in data[offset:].split(b"\0")]
+
+
+def chunk(name, payload_length):
+    return name + struct.pack("<I", payload_length)
+
+
+class XwbEntry():
+    def __init__(self, index, name, format, offset, length, samples, seek_table):
+        self.index = index
+        self.name = name
+        self.format_tag = format & 0x3
+        self.channels = (format >> 2) & 0x7
+        self.sample_rate = (format >> 5) & 0x3FFFF
+        self.block_align_field = (format >> 23) & 0xFF
+        self.bits_field = format >> 31
+        self.offset = offset
+        self.length = length
+        self.samples = samples
+        self.seek_table = seek_table
+
+    @property
+    def extension(self):
+        """File extension of the written entry, or None if its format can't be written"""
+        if self.format_tag in (TAG_PCM, TAG_ADPCM):
+            return ".wav"
+        if self.format_tag == TAG_WMA:
+            return ".wma"
+        return None
+
+    @property
+    def block_align(self):
+        if self.format_tag == TAG_ADPCM:
+            return (self.block_align_field + ADPCM_BLOCKALIGN_CONVERSION_OFFSET) * self.channels
+        if self.format_tag == TAG_WMA:
+            return WMA_BLOCK_ALIGN[self.block_align_field & 0x1F]
+        return self.channels * self.bits_per_sample // 8
+
+    @property
+    def bits_per_sample(self):
+        if self.format_tag == TAG_ADPCM:
+            return 4
+        if self.format_tag == TAG_WMA or self.bits_field:
+            return 16
+        return 8
+
+    @property
+    def adpcm_samples_per_block(self):
+        return (self.block_align - 7 * self.channels) * 2 // self.channels + 2
+
+    @property
+    def avg_bytes_per_sec(self):
+        if self.format_tag == TAG_ADPCM:
+            return self.sample_rate * self.block_align // self.adpcm_samples_per_block
+        if self.format_tag == TAG_WMA:
+            return WMA_AVG_BYTES_PER_SEC[self.block_align_field >> 5]
+        return self.sample_rate * self.block_align
+
+    @property
+    def duration(self):
+        """Length in seconds, from the entry table or else from the size of the data"""
+        if self.samples and self.sample_rate:
+            return self.samples / self.sample_rate
+        if self.format_tag == TAG_ADPCM and self.sample_rate:
+            return self.length // self.block_align * self.adpcm_samples_per_block / self.sample_rate
+        if self.avg_bytes_per_sec:
+            return self.length / self.avg_bytes_per_sec
+        return 0
+
+    @property
+    def wave_format(self):
+        if self.format_tag == TAG_ADPCM:
+            return WAVE_FORMAT_ADPCM
+        if self.format_tag == TAG_WMA:
+            return WAVE_FORMAT_WMAUDIO3 if self.bits_field else WAVE_FORMAT_WMAUDIO2
+        return WAVE_FORMAT_PCM
+
+    def header(self):
+        """RIFF header of the written entry, up to the start of the sample data"""
+        format_chunk = struct.pack(
+            "<HHIIHH",
+            self.wave_format, self.channels, self.sample_rate,
+            self.avg_bytes_per_sec, self.block_align, self.bits_per_sample,
+        )
+        if self.format_tag == TAG_ADPCM:
+            format_chunk += struct.pack("<HHH", 4 + 4 * len(ADPCM_COEFFICIENTS), self.adpcm_samples_per_block,
+                                        len(ADPCM_COEFFICIENTS))
+            for coefficients in ADPCM_COEFFICIENTS:
+                format_chunk += struct.pack("<hh", *coefficients)
+        elif self.format_tag == TAG_WMA:
+            format_chunk += struct.pack("<H", 0)
+        chunks = chunk(b"fmt ", len(format_chunk)) + format_chunk
+        riff_type = b"WAVE"
+        if self.format_tag == TAG_ADPCM:
+            # compressed wav files carry their length in samples
+            samples = self.samples or self.length // self.block_align * self.adpcm_samples_per_block
+            chunks += chunk(b"fact", 4) + struct.pack("<I", samples)
+        if self.format_tag == TAG_WMA:
+            riff_type = b"XWMA"
+            # cumulative decoded bytes per packet, which xWMA decoders need to seek
+            seek_table = self.seek_table or b""
+            chunks += chunk(b"dpds", len(seek_table)) + seek_table
+        chunks += chunk(b"data", self.length)
+        riff_length = 4 + len(chunks) + self.length + self.length % 2
+        return chunk(b"RIFF", riff_length) + riff_type + chunks
+
+
+class XwbArchive():
+    """An XACT wave bank, memory mapped so entries are written straight from the bank
+
+    names are used for entries in order, before any names stored in the bank
+    itself. Use as a context manager so the mapping is closed afterwards.
+    """
+    def __init__(self, path, names=None):
+        self.path = Path(path)
+        with open(self.path, "rb") as bank_file:
+            self.map = mmap.mmap(bank_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.entries = self.read_entries(names or [])
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.map.close()
+
+    def read_entries(self, names):
+        bank = self.map
+        signature, version, header_version = HEADER.unpack_from(bank)
+        if signature != SIGNATURE:
+            # DNBW banks are big endian, from the Xbox 360
+            raise ValueError("not a little endian XACT wave bank: " + str(self.path))
+        if version < MIN_VERSION:
+            raise ValueError("unsupported XACT wave bank version " + str(version) + ": " + str(self.path))
+        segments = [
+            SEGMENT.unpack_from(bank, HEADER.size + SEGMENT.size * segment)
+            for segment in range(SEGMENT_COUNT)
+        ]
+        flags, count, _, metadata_size, name_size, alignment, compact_format = BANK.unpack_from(
+            bank, segments[BANK_DATA][0]
+        )
+        wave_data_offset, wave_data_length = segments[ENTRY_WAVE_DATA]
+        metadata_offset = segments[ENTRY_METADATA][0]
+        entries = []
+        for index in range(count):
+            position = metadata_offset + index * metadata_size
+            if flags & FLAGS_COMPACT:
+                # 21 bits of offset in units of the alignment, then 11 bits of padding
+                # at the end of the entry, whose length runs up to the next entry
+                offsets = []
+                for entry_index in (index, index + 1):
+                    if entry_index < count:
+                        value, = struct.unpack_from("<I", bank, metadata_offset + entry_index * metadata_size)
+                        offsets.append(((value & 0x1FFFFF) * alignment, value >> 21))
+                    else:
+                        offsets.append((wave_data_length, 0))
+                offset, deviation = offsets[0]
+                length = offsets[1][0] - offset - deviation
+                format = compact_format
+                samples = None
+            else:
+                flags_and_duration, format, offset, length = ENTRY.unpack_from(bank, position)
+                samples = flags_and_duration >> 4
+            name = None
+            if index < len(names):
+                name = names[index]
+            elif flags & FLAGS_ENTRYNAMES and segments[ENTRY_NAMES][1]:
+                name_offset = segments[ENTRY_NAMES][0] + index * name_size
+                name = bank[name_offset:name_offset + name_size].split(b"\0", 1)[0].decode("latin-1")
+            if not name:
+                name = f"{index:08x}"
+            entries.append(XwbEntry(
+                index, name, format, wave_data_offset + offset, length, samples,
+                self.read_seek_table(segments[SEEK_TABLES], count, index),
+            ))
+        return entries
+
+    def read_seek_table(self, segment, count, index):
+        segment_offset, segment_length = segment
+        if segment_length < 4 * count:
+            return None
+        table_offset, = struct.unpack_from("<I", self.map, segment_offset + 4 * index)
+        if table_offset == 0xFFFFFFFF:
+            return None
+        table_offset += segment_offset + 4 * count
+        table_count, = struct.unpack_from("<I", self.map, table_offset)
+        return self.map[table_offset + 4:table_offset + 4 + 4 * table_count]
+
+    def write(self, entry, file):
+        """Write an entry to a binary file with a RIFF header, straight from the mapped bank"""
+        file.write(entry.header())
+        with memoryview(self.map)[entry.offset:entry.offset + entry.length] as view:
+            file.write(view)
+        if entry.length % 2:
+            file.write(b"\0")